@@ -0,0 +1,159 @@
+"""
+    End-to-end load benchmark of the gateway against the local Micromatic simulator and MQTT broker.
+
+    For each thermostat count the gateway (src/main.py) is started as a subprocess pointed at the
+    simulator and the broker. The benchmark then measures:
+        - startup time until every discovery config is published
+        - websocket notification to MQTT state publish latency and throughput
+        - MQTT command to API change request latency
+
+    Run from the repository root: python benchmarks/bench_end_to_end.py --thermostats 10 100 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from micromatic_simulator import MicromaticSimulator
+from mqtt_broker import MqttBroker
+
+GATEWAY = os.path.join(os.path.dirname(__file__), "..", "src", "main.py")
+PREFIX = "homeassistant"
+
+
+def percentiles(values: List[float]) -> str:
+    if not values:
+        return "no samples"
+
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))] * 1000  # noqa: E731
+
+    return (f"n={len(values):6d}  p50={pick(0.50):7.2f} ms  p95={pick(0.95):7.2f} ms  "
+            f"p99={pick(0.99):7.2f} ms  max={values[-1] * 1000:7.2f} ms  mean={statistics.mean(values) * 1000:7.2f} ms")
+
+
+class Probe:
+    """
+        Correlates simulator events with messages the gateway publishes on the broker.
+    """
+
+    def __init__(self, simulator: MicromaticSimulator, broker: MqttBroker, thermostat_count: int):
+        self.thermostat_count = thermostat_count
+        self.configs: set = set()
+        self.all_configs = asyncio.Event()
+        self.updates_sent: Dict[Tuple[str, int], float] = {}
+        self.update_latencies: List[float] = []
+        self.commands_sent: Dict[Tuple[str, int], float] = {}
+        self.command_latencies: List[float] = []
+        self.state_messages = 0
+        self.measuring = False
+        simulator.on_update = self.on_update
+        simulator.on_change = self.on_change
+        broker.on_publish = self.on_publish
+
+    def on_update(self, serialnumber: str, data: dict):
+        if self.measuring:
+            self.updates_sent[(serialnumber, data["TemperatureRoom"])] = time.perf_counter()
+
+    def on_change(self, serialnumber: str, data: dict):
+        sent = self.commands_sent.pop((serialnumber, data.get("ManuelRoomTemperature")), None)
+        if sent is not None:
+            self.command_latencies.append(time.perf_counter() - sent)
+
+    def on_publish(self, topic: str, payload: bytes):
+        levels = topic.split("/")
+        if levels[-1] == "config" and levels[1] == "climate":
+            self.configs.add(topic)
+            if len(self.configs) >= self.thermostat_count:
+                self.all_configs.set()
+        elif levels[-1] == "state" and levels[1] == "climate" and self.measuring:
+            self.state_messages += 1
+            serialnumber = levels[2].rsplit("_", 1)[1]
+            temperature = round(json.loads(payload)["current_temperature"] * 100)
+            sent = self.updates_sent.pop((serialnumber, temperature), None)
+            if sent is not None:
+                self.update_latencies.append(time.perf_counter() - sent)
+
+
+async def run_scenario(args, thermostat_count: int):
+    simulator = MicromaticSimulator(thermostat_count, args.update_rate, args.latency)
+    broker = MqttBroker()
+    probe = Probe(simulator, broker, thermostat_count)
+    await simulator.start(port=args.api_port)
+    await broker.start(port=args.mqtt_port)
+
+    start = time.perf_counter()
+    gateway = await asyncio.create_subprocess_exec(
+        sys.executable, GATEWAY,
+        "--mqtt_broker", "127.0.0.1", "--mqtt_port", str(args.mqtt_port),
+        "--mqtt_username", "bench", "--mqtt_password", "bench", "--config_prefix", PREFIX,
+        "--micromatic_username", "bench", "--micromatic_password", "bench",
+        "--api_base_url", f"http://127.0.0.1:{args.api_port}",
+        "--command_coalesce_window", str(args.coalesce_window), "--api_rate_limit", "0",
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL if not args.verbose else None)
+
+    try:
+        await asyncio.wait_for(probe.all_configs.wait(), 60)
+        startup = time.perf_counter() - start
+        while not simulator.clients:
+            await asyncio.sleep(0.05)
+
+        await asyncio.sleep(args.warmup)
+        probe.measuring = True
+        measure_start = time.perf_counter()
+        sent_updates = simulator.sent_updates
+        serialnumbers = list(simulator.thermostats)
+        command_interval = 1 / args.command_rate if args.command_rate > 0 else None
+        next_command = time.perf_counter()
+        target = 1200
+        command_count = 0
+
+        while time.perf_counter() - measure_start < args.duration:
+            if command_interval is not None and time.perf_counter() >= next_command:
+                next_command += command_interval
+                serialnumber = serialnumbers[command_count % len(serialnumbers)]
+                command_count += 1
+                target = target + 50 if target < 3000 else 1200
+                probe.commands_sent[(serialnumber, target)] = time.perf_counter()
+                payload = json.dumps({"unique_id": serialnumber, "target_temperature": target / 100, "mode": "heat"})
+                broker.publish(f"{PREFIX}/climate/micromatic_thermostat_{serialnumber}/set", payload)
+            await asyncio.sleep(0.001)
+
+        elapsed = time.perf_counter() - measure_start
+        print(f"{thermostat_count} thermostats (update rate {args.update_rate}/s, API latency {args.latency * 1000:.0f} ms)")
+        print(f"  startup until all configs published: {startup:.2f} s")
+        print(f"  websocket notifications: {(simulator.sent_updates - sent_updates) / elapsed:8.1f}/s  "
+              f"state publishes: {probe.state_messages / elapsed:8.1f}/s")
+        print(f"  websocket -> MQTT state:  {percentiles(probe.update_latencies)}")
+        print(f"  MQTT command -> API POST: {percentiles(probe.command_latencies)}")
+    finally:
+        gateway.terminate()
+        await gateway.wait()
+        await broker.stop()
+        await simulator.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--thermostats", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--update_rate", type=float, default=50, help="Websocket updates per second across all thermostats")
+    parser.add_argument("--command_rate", type=float, default=5, help="MQTT commands per second")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every simulated REST response")
+    parser.add_argument("--coalesce_window", type=float, default=0.0)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=1)
+    parser.add_argument("--api_port", type=int, default=18088)
+    parser.add_argument("--mqtt_port", type=int, default=11883)
+    parser.add_argument("--verbose", action="store_true", help="Show gateway log output")
+    args = parser.parse_args()
+
+    for thermostat_count in args.thermostats:
+        await run_scenario(args, thermostat_count)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
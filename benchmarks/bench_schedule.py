@@ -0,0 +1,80 @@
+"""
+    Microbenchmark comparing the auto-mode target lookup in Thermostat.to_hass_state with the
+    previous implementation that parsed every schedule event with strptime on each call.
+
+    Run from the repository root: python benchmarks/bench_schedule.py
+"""
+import datetime
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from Microtemp import ScheduleIndex  # noqa: E402
+
+
+def make_schedule(events_per_day: int = 4) -> dict:
+    days = []
+    for _ in range(7):
+        events = []
+        for i in range(events_per_day):
+            hour = 6 + i * (16 // events_per_day)
+            events.append({"Clock": f"{hour:02d}:30:00", "Active": True, "EventIsComfortTemp": i % 2 == 0})
+        days.append({"Events": events})
+
+    return {"ComfortTemperatureRoom": 2200, "SetbackTemperatureRoom": 1800, "Days": days}
+
+
+def legacy_target(schedule: dict, manual_temp: float):
+    target_temp = manual_temp
+    event_on_previous_day = True
+    current_day = datetime.datetime.today().weekday()
+    for item in schedule['Days'][current_day]["Events"]:
+        if not item["Active"]:
+            continue
+
+        now_time = datetime.datetime.now()
+        schedule_time = datetime.datetime.strptime(item['Clock'], '%H:%M:%S')
+        schedule_time = schedule_time.replace(day=now_time.day, month=now_time.month, year=now_time.year)
+
+        if now_time >= schedule_time:
+            target_temp = schedule['ComfortTemperatureRoom'] / \
+                100 if item['EventIsComfortTemp'] else schedule['SetbackTemperatureRoom'] / 100
+            event_on_previous_day = False
+
+    if event_on_previous_day:
+        day = current_day - 1 if current_day - 1 >= 0 else 6
+        for item in reversed(schedule['Days'][day]["Events"]):
+            if not item["Active"]:
+                continue
+
+            target_temp = schedule['ComfortTemperatureRoom'] / \
+                100 if item['EventIsComfortTemp'] else schedule['SetbackTemperatureRoom'] / 100
+            break
+
+    return target_temp
+
+
+def indexed_target(index: ScheduleIndex, manual_temp: float):
+    target_temp = index.target_at(datetime.datetime.now())
+    return manual_temp if target_temp is None else target_temp
+
+
+def main():
+    number = 20000
+    for events_per_day in (2, 4, 8):
+        schedule = make_schedule(events_per_day)
+        index = ScheduleIndex(schedule)
+        assert legacy_target(schedule, 21.0) == indexed_target(index, 21.0)
+
+        legacy = min(timeit.repeat(lambda: legacy_target(schedule, 21.0), number=number, repeat=5)) / number
+        indexed = min(timeit.repeat(lambda: indexed_target(index, 21.0), number=number, repeat=5)) / number
+        compile_cost = min(timeit.repeat(lambda: ScheduleIndex(schedule), number=1000, repeat=5)) / 1000
+
+        print(f"{events_per_day} events/day: legacy {legacy * 1e6:8.2f} us  indexed {indexed * 1e6:6.2f} us  "
+              f"speedup {legacy / indexed:5.1f}x  (one-off compile {compile_cost * 1e6:.2f} us)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+    Memory and serialization cost of the slotted Thermostat model compared with the previous plain
+    dataclass serialized through dataclasses.asdict, for registries of thousands of thermostats.
+
+    Run from the repository root: python benchmarks/bench_thermostat_model.py
+"""
+import copy
+import dataclasses
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import Microtemp  # noqa: E402
+from bench_schedule import make_schedule  # noqa: E402
+from bench_websocket_decode import make_thermostat  # noqa: E402
+
+LegacyThermostat = dataclasses.make_dataclass(
+    "LegacyThermostat",
+    [(item.name, item.type, item) for item in dataclasses.fields(Microtemp.Thermostat) if item.init])
+
+
+def legacy_payload(thermostat) -> str:
+    return json.dumps(dataclasses.asdict(thermostat))
+
+
+def slotted_payload(thermostat) -> str:
+    return json.dumps(thermostat.as_dict())
+
+
+def build_registry(factory, count: int) -> dict:
+    # Schedules are copied so every thermostat owns its nested data, as it does in production.
+    registry = {}
+    for i in range(count):
+        data = make_thermostat(f"{i:08d}")
+        data["Schedule"] = copy.deepcopy(make_schedule(4))
+        registry[data["SerialNumber"]] = factory(data)
+
+    return registry
+
+
+def model_bytes(factory, count: int) -> float:
+    # Measures the model objects only; the API dicts are built up front and shared by both models.
+    data = [make_thermostat(f"{i:08d}") for i in range(count)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    registry = [factory(item) for item in data]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del registry
+
+    return (after - before) / count
+
+
+def serialize_seconds(serialize, registry: dict) -> float:
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for thermostat in registry.values():
+            serialize(thermostat)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def main():
+    legacy_factory = lambda data: LegacyThermostat(**data)  # noqa: E731
+    slotted_factory = Microtemp.Thermostat.from_api
+
+    for count in (1000, 5000):
+        legacy_mem = model_bytes(legacy_factory, count)
+        slotted_mem = model_bytes(slotted_factory, count)
+        legacy_registry = build_registry(legacy_factory, count)
+        slotted_registry = build_registry(slotted_factory, count)
+        legacy_time = serialize_seconds(legacy_payload, legacy_registry)
+        slotted_time = serialize_seconds(slotted_payload, slotted_registry)
+
+        print(f"{count} thermostats:")
+        print(f"  model memory    legacy {legacy_mem:7.0f} B/thermostat  slotted {slotted_mem:7.0f} B/thermostat")
+        print(f"  change payload  legacy {legacy_time / count * 1e6:7.2f} us/thermostat  "
+              f"slotted {slotted_time / count * 1e6:7.2f} us/thermostat  ({legacy_time / slotted_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+    Benchmark of the websocket notification decode path: the previous json.loads + dacite.from_dict
+    path that built a new Thermostat per notification, against parse_notification and in-place
+    Thermostat.update_from_api. Reports messages per second. The legacy path is only measured when
+    dacite is installed; the gateway itself no longer depends on it.
+
+    Run from the repository root: python benchmarks/bench_websocket_decode.py
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+try:
+    from dacite import from_dict
+except ImportError:
+    from_dict = None
+
+import Microtemp  # noqa: E402
+from bench_schedule import make_schedule  # noqa: E402
+
+
+def make_thermostat(serialnumber: str) -> dict:
+    return {
+        "SerialNumber": serialnumber, "GroupName": "Stue", "GroupId": 1, "TemperatureRoom": 2150,
+        "TemperatureFloor": 2400, "SensorApplication": 0, "Address": "", "SateliteType": 0, "ErrorCode": 0,
+        "RelayOn2Days": 12, "RelayOn30Days": 180, "RelayOn365Days": 2100, "RegulationMode": 1,
+        "VacationBeginDay": "", "VacationEndDay": "", "VacationBeginTime": "", "VacationEndTime": "",
+        "VacationTemperature": 1200, "ComfortTime": "", "ManuelRoomTemperature": 2200,
+        "ManuelFloorTemperature": 2200, "ManuelRegulator": 0, "FrostRoomTemperature": 500,
+        "FrostFloorTemperature": 500, "LosEnabled": False, "LosTempAuto": 0, "LosTempFrost": 0,
+        "IdentifyThermo": False, "UtcOffset": 60, "Schedule": make_schedule(4)
+    }
+
+
+def make_frame(serialnumber: str) -> str:
+    notification = json.dumps({"Thermostat": make_thermostat(serialnumber)})
+    return json.dumps({"C": "d-1", "M": [notification]})
+
+
+def legacy_path(frame: str, thermostats: dict):
+    message = json.loads(frame)
+    for item in message['M']:
+        if isinstance(item, str):
+            item = json.loads(item)
+            thermo = from_dict(data_class=Microtemp.Thermostat, data=item['Thermostat'])
+            thermostats[thermo.SerialNumber] = thermo
+
+
+def fast_path(frame: str, thermostats: dict):
+    for data in Microtemp.parse_notification(frame):
+        thermo = thermostats.get(data['SerialNumber'])
+        if thermo is None:
+            thermostats[data['SerialNumber']] = Microtemp.Thermostat.from_api(data)
+        else:
+            thermo.update_from_api(data)
+
+
+def messages_per_second(path, frames: list, rounds: int = 5) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        thermostats = {}
+        start = time.perf_counter()
+        for frame in frames:
+            path(frame, thermostats)
+        best = min(best, time.perf_counter() - start)
+
+    return len(frames) / best
+
+
+def main():
+    print(f"JSON backend: {Microtemp.json_loads.__module__}")
+    frames = [make_frame(f"{i % 50:08d}") for i in range(5000)]
+    fast = messages_per_second(fast_path, frames)
+    if from_dict is None:
+        print("legacy (json + dacite): skipped, dacite is not installed")
+        print(f"in-place decoder:       {fast:10.0f} msg/s")
+        return
+
+    legacy = messages_per_second(legacy_path, frames)
+    print(f"legacy (json + dacite): {legacy:10.0f} msg/s")
+    print(f"in-place decoder:       {fast:10.0f} msg/s  ({fast / legacy:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+    Local stand-in for the Micromatic cloud (min.microtemp.no) covering the endpoints used by
+    ApiConnection and Websocket: authenticate, thermostats, thermostat/change and the SignalR
+    gatewaynotification negotiate/start/connect websocket.
+
+    Simulates a configurable number of thermostats that report temperature updates over the websocket
+    at a configurable total rate, with a configurable latency added to every REST response.
+
+    Run standalone: python benchmarks/micromatic_simulator.py --thermostats 50 --update_rate 10
+    and start the gateway with --api_base_url http://127.0.0.1:8088
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+import uuid
+from typing import Callable, Dict, List, Set
+
+from aiohttp import WSMsgType, web
+
+from bench_websocket_decode import make_thermostat
+
+
+class MicromaticSimulator:
+
+    def __init__(self, thermostat_count: int = 10, update_rate: float = 1, latency: float = 0.0):
+        self.update_rate = update_rate
+        self.latency = latency
+        self.session_id = uuid.uuid4().hex
+        self.thermostats: Dict[str, dict] = {}
+        for i in range(thermostat_count):
+            data = make_thermostat(f"SIM{i:05d}")
+            self.thermostats[data["SerialNumber"]] = data
+
+        self.clients: Set[web.WebSocketResponse] = set()
+        self.sent_updates: int = 0
+        self.change_requests: int = 0
+        # Called with (serialnumber, data) when a simulated temperature update is sent and when a change request arrives.
+        self.on_update: Callable = None
+        self.on_change: Callable = None
+        self._temperatures = itertools.cycle(range(1000, 4000))
+        self._runner: web.AppRunner = None
+        self._update_task: asyncio.Task = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/api/authenticate/user", self.authenticate)
+        app.router.add_get("/api/thermostats", self.get_thermostats)
+        app.router.add_post("/api/thermostat/change", self.change)
+        app.router.add_get("/gatewaynotification/negotiate", self.negotiate)
+        app.router.add_get("/gatewaynotification/start", self.start_notifications)
+        app.router.add_get("/gatewaynotification/connect", self.connect)
+
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8088):
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        if self.update_rate > 0:
+            self._update_task = asyncio.create_task(self._update_loop())
+
+    async def stop(self):
+        if self._update_task is not None:
+            self._update_task.cancel()
+        for client in list(self.clients):
+            await client.close()
+        await self._runner.cleanup()
+
+    async def _delay(self):
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+    def _authorized(self, request: web.Request) -> bool:
+        return request.query.get("sessionid") == self.session_id
+
+    async def authenticate(self, request: web.Request) -> web.Response:
+        await self._delay()
+        return web.json_response({
+            "SessionId": self.session_id, "NewAccount": False, "ErrorCode": 0, "RoleType": 0,
+            "CustomerId": 1, "Language": "nb-NO", "AcceptedTOC": True
+        })
+
+    async def get_thermostats(self, request: web.Request) -> web.Response:
+        await self._delay()
+        if not self._authorized(request):
+            return web.Response(status=401)
+
+        return web.json_response({"Groups": [{"Thermostats": list(self.thermostats.values())}]})
+
+    async def change(self, request: web.Request) -> web.Response:
+        await self._delay()
+        if not self._authorized(request):
+            return web.Response(status=401)
+
+        serialnumber = request.query.get("serialnumber")
+        if serialnumber not in self.thermostats:
+            return web.Response(status=404)
+
+        data = json.loads(await request.text())
+        self.thermostats[serialnumber].update(data)
+        self.change_requests += 1
+        if self.on_change is not None:
+            self.on_change(serialnumber, data)
+
+        # The real service echoes the new state as a websocket notification.
+        asyncio.get_running_loop().call_soon(self._notify, serialnumber)
+
+        return web.json_response(True)
+
+    async def negotiate(self, request: web.Request) -> web.Response:
+        await self._delay()
+        return web.json_response({"ConnectionToken": uuid.uuid4().hex, "ConnectionId": uuid.uuid4().hex})
+
+    async def start_notifications(self, request: web.Request) -> web.Response:
+        await self._delay()
+        return web.json_response({"Response": "started"})
+
+    async def connect(self, request: web.Request) -> web.WebSocketResponse:
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+
+        # The client authenticates by sending its session ID as the first message.
+        message = await websocket.receive()
+        if message.type != WSMsgType.TEXT or message.data != self.session_id:
+            await websocket.close()
+            return websocket
+
+        self.clients.add(websocket)
+        try:
+            async for _ in websocket:
+                pass
+        finally:
+            self.clients.discard(websocket)
+
+        return websocket
+
+    def _notify(self, serialnumber: str):
+        data = self.thermostats[serialnumber]
+        frame = json.dumps({"C": "d-1", "M": [json.dumps({"Thermostat": data})]})
+        self.sent_updates += 1
+
+        for client in list(self.clients):
+            asyncio.ensure_future(client.send_str(frame))
+
+    async def _update_loop(self):
+        serialnumbers: List[str] = list(self.thermostats)
+        interval = 1 / self.update_rate
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+
+        while True:
+            next_time += interval
+            await asyncio.sleep(max(0, next_time - loop.time()))
+            if not self.clients:
+                continue
+
+            serialnumber = random.choice(serialnumbers)
+            self.thermostats[serialnumber]["TemperatureRoom"] = next(self._temperatures)
+            if self.on_update is not None:
+                self.on_update(serialnumber, self.thermostats[serialnumber])
+            self._notify(serialnumber)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--thermostats", type=int, default=10)
+    parser.add_argument("--update_rate", type=float, default=1, help="Websocket updates per second across all thermostats")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every REST response")
+    args = parser.parse_args()
+
+    simulator = MicromaticSimulator(args.thermostats, args.update_rate, args.latency)
+    await simulator.start(port=args.port)
+    print(f"Simulating {args.thermostats} thermostats on http://127.0.0.1:{args.port} (session {simulator.session_id})")
+
+    while True:
+        await asyncio.sleep(10)
+        print(f"{time.strftime('%H:%M:%S')} updates sent: {simulator.sent_updates}  change requests: {simulator.change_requests}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,279 @@
+"""
+    Minimal in-process MQTT broker for local testing and benchmarks.
+
+    Supports MQTT 3.1.1 and 5.0 clients with QoS 0 delivery, retained messages, + and # wildcards,
+    last will messages and keep-alive pings. Properties sent by MQTT 5 clients are skipped.
+    The on_publish hook sees every message published by a client, and publish() injects messages
+    from the broker itself. Not intended for production use.
+
+    Run standalone: python benchmarks/mqtt_broker.py --port 1883
+"""
+import argparse
+import asyncio
+import logging
+import struct
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("mqtt_broker")
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(topic_levels) or (level != "+" and level != topic_levels[i]):
+            return False
+
+    return len(filter_levels) == len(topic_levels)
+
+
+def encode_length(length: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+
+def encode_string(value: bytes) -> bytes:
+    return struct.pack("!H", len(value)) + value
+
+
+class Reader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.position = 0
+
+    def uint8(self) -> int:
+        value = self.data[self.position]
+        self.position += 1
+        return value
+
+    def uint16(self) -> int:
+        value = struct.unpack_from("!H", self.data, self.position)[0]
+        self.position += 2
+        return value
+
+    def varint(self) -> int:
+        value, multiplier = 0, 1
+        while True:
+            byte = self.uint8()
+            value += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                return value
+            multiplier *= 128
+
+    def binary(self) -> bytes:
+        length = self.uint16()
+        value = self.data[self.position:self.position + length]
+        self.position += length
+        return value
+
+    def skip_properties(self):
+        length = self.varint()
+        self.position += length
+
+    def rest(self) -> bytes:
+        return self.data[self.position:]
+
+
+class Session:
+    def __init__(self, broker: "MqttBroker", reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.client_id = ""
+        self.version = 4
+        self.subscriptions: List[str] = []
+        self.will: Optional[Tuple[str, bytes, bool]] = None
+
+    def send(self, packet_type: int, body: bytes, flags: int = 0):
+        self.writer.write(bytes([packet_type << 4 | flags]) + encode_length(len(body)) + body)
+
+    def deliver(self, topic: str, payload: bytes, retain: bool = False):
+        body = encode_string(topic.encode())
+        if self.version == 5:
+            body += b"\x00"
+        self.send(PUBLISH, body + payload, flags=1 if retain else 0)
+
+    async def read_packet(self) -> Tuple[int, int, bytes]:
+        header = (await self.reader.readexactly(1))[0]
+        length, multiplier = 0, 1
+        while True:
+            byte = (await self.reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+
+        return header >> 4, header & 0x0F, await self.reader.readexactly(length)
+
+    def handle_connect(self, body: bytes):
+        reader = Reader(body)
+        reader.binary()
+        self.version = reader.uint8()
+        flags = reader.uint8()
+        reader.uint16()
+        if self.version == 5:
+            reader.skip_properties()
+
+        self.client_id = reader.binary().decode()
+        if flags & 0x04:
+            if self.version == 5:
+                reader.skip_properties()
+            will_topic = reader.binary().decode()
+            will_payload = reader.binary()
+            self.will = (will_topic, will_payload, bool(flags & 0x20))
+
+        self.broker.take_over(self)
+        self.send(CONNACK, b"\x00\x00\x00" if self.version == 5 else b"\x00\x00")
+
+    def handle_publish(self, flags: int, body: bytes):
+        reader = Reader(body)
+        topic = reader.binary().decode()
+        qos = (flags >> 1) & 0x03
+        packet_id = reader.uint16() if qos else None
+        if self.version == 5:
+            reader.skip_properties()
+
+        if packet_id is not None:
+            self.send(PUBACK, struct.pack("!H", packet_id))
+
+        self.broker.publish(topic, reader.rest(), bool(flags & 0x01), source=self)
+
+    def handle_subscribe(self, body: bytes):
+        reader = Reader(body)
+        packet_id = reader.uint16()
+        if self.version == 5:
+            reader.skip_properties()
+
+        topic_filters = []
+        while reader.position < len(body):
+            topic_filters.append(reader.binary().decode())
+            reader.uint8()
+
+        self.subscriptions += topic_filters
+        properties = b"\x00" if self.version == 5 else b""
+        self.send(SUBACK, struct.pack("!H", packet_id) + properties + b"\x00" * len(topic_filters))
+
+        for topic, payload in list(self.broker.retained.items()):
+            if any(topic_matches(topic_filter, topic) for topic_filter in topic_filters):
+                self.deliver(topic, payload, retain=True)
+
+    def handle_unsubscribe(self, body: bytes):
+        reader = Reader(body)
+        packet_id = reader.uint16()
+        if self.version == 5:
+            reader.skip_properties()
+
+        count = 0
+        while reader.position < len(body):
+            topic_filter = reader.binary().decode()
+            if topic_filter in self.subscriptions:
+                self.subscriptions.remove(topic_filter)
+            count += 1
+
+        properties = b"\x00" + b"\x00" * count if self.version == 5 else b""
+        self.send(UNSUBACK, struct.pack("!H", packet_id) + properties)
+
+    async def run(self):
+        clean_disconnect = False
+        try:
+            while True:
+                packet_type, flags, body = await self.read_packet()
+                if packet_type == CONNECT:
+                    self.handle_connect(body)
+                elif packet_type == PUBLISH:
+                    self.handle_publish(flags, body)
+                elif packet_type == SUBSCRIBE:
+                    self.handle_subscribe(body)
+                elif packet_type == UNSUBSCRIBE:
+                    self.handle_unsubscribe(body)
+                elif packet_type == PINGREQ:
+                    self.send(PINGRESP, b"")
+                elif packet_type == DISCONNECT:
+                    clean_disconnect = True
+                    break
+                await self.writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.broker.remove(self)
+            self.writer.close()
+            if not clean_disconnect and self.will is not None:
+                self.broker.publish(*self.will)
+
+
+class MqttBroker:
+
+    def __init__(self):
+        self.sessions: Dict[str, Session] = {}
+        self.retained: Dict[str, bytes] = {}
+        # Called with (topic, payload) for every message published by a client.
+        self.on_publish: Callable = None
+        self._server: asyncio.AbstractServer = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 1883):
+        self._server = await asyncio.start_server(self._accept, host, port)
+
+    async def stop(self):
+        self._server.close()
+        for session in list(self.sessions.values()):
+            session.writer.close()
+        await self._server.wait_closed()
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        await Session(self, reader, writer).run()
+
+    def take_over(self, session: Session):
+        # A new connection with an existing client ID replaces the old one, as on a real broker.
+        previous = self.sessions.get(session.client_id)
+        if previous is not None and previous is not session:
+            previous.writer.close()
+        self.sessions[session.client_id] = session
+
+    def remove(self, session: Session):
+        if self.sessions.get(session.client_id) is session:
+            del self.sessions[session.client_id]
+
+    def publish(self, topic: str, payload: bytes, retain: bool = False, source: Session = None):
+        if isinstance(payload, str):
+            payload = payload.encode()
+
+        if retain:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+
+        if source is not None and self.on_publish is not None:
+            self.on_publish(topic, payload)
+
+        for session in list(self.sessions.values()):
+            if any(topic_matches(topic_filter, topic) for topic_filter in session.subscriptions):
+                session.deliver(topic, payload)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    broker = MqttBroker()
+    broker.on_publish = lambda topic, payload: logger.info("%s %s", topic, payload[:200])
+    await broker.start(port=args.port)
+    logger.info("MQTT broker listening on port %d", args.port)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
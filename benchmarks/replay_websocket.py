@@ -0,0 +1,172 @@
+"""
+    Replays websocket traffic recorded with --websocket_capture_file through the gateway's
+    handle_websocket_msg against a fake MqttConnector, without the Micromatic cloud or an MQTT broker.
+
+    Frames are fed at their recorded pace (--speed 1), accelerated (--speed 10) or as fast as
+    possible (--speed 0). The thermostat inventory is built from the first notification of each
+    thermostat in the capture, as refresh_from_api would at startup. Reports the cost of handling
+    each frame and the MQTT messages it produced; --output saves the summary and --baseline compares
+    against a saved summary to spot regressions between versions.
+
+    Several capture files, one per recording session, are merged in time order.
+
+    Run from the repository root: python benchmarks/replay_websocket.py capture.*.json.gz --speed 0
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import Account  # noqa: E402
+import Liveness  # noqa: E402
+import main as gateway  # noqa: E402
+import Microtemp  # noqa: E402
+import MqttRelay  # noqa: E402
+from WebsocketCapture import read_capture  # noqa: E402
+
+
+class FakeMqttClient:
+    """
+        Stands in for the gmqtt client and only counts what would have been sent to the broker.
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+    def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False):
+        self.messages += 1
+        self.bytes += len(topic) + len(payload or "")
+
+
+def load_frames(paths: List[str]) -> List[Tuple[float, str]]:
+    frames = []
+    for path in paths:
+        frames += read_capture(path)
+
+    return sorted(frames, key=lambda frame: frame[0])
+
+
+def initial_inventory(frames: List[Tuple[float, str]]) -> dict:
+    inventory = {}
+    for _, frame in frames:
+        try:
+            notifications = Microtemp.parse_notification(frame)
+        except ValueError:
+            continue
+        for data in notifications:
+            inventory.setdefault(data["SerialNumber"], data)
+
+    return inventory
+
+
+def summarize(costs: List[float], elapsed: float, client: FakeMqttClient, mqtt_con: MqttRelay.MqttConnector, lag: List[float]) -> dict:
+    costs = sorted(costs)
+    pick = lambda q: costs[min(len(costs) - 1, int(q * len(costs)))] * 1e6  # noqa: E731
+
+    return {
+        "frames": len(costs),
+        "elapsed_s": elapsed,
+        "frames_per_s": len(costs) / elapsed if elapsed else 0,
+        "mean_us": statistics.mean(costs) * 1e6,
+        "p50_us": pick(0.50),
+        "p95_us": pick(0.95),
+        "p99_us": pick(0.99),
+        "max_us": costs[-1] * 1e6,
+        "mqtt_messages": client.messages,
+        "mqtt_bytes": client.bytes,
+        "mqtt_suppressed": mqtt_con.suppressed_messages,
+        "max_lag_ms": max(lag) * 1000 if lag else 0,
+    }
+
+
+async def replay(frames: List[Tuple[float, str]], speed: float, repeat: int) -> dict:
+    client = FakeMqttClient()
+    mqtt_con = MqttRelay.MqttConnector("replay", 0, "", "", "homeassistant")
+    mqtt_con.client = client
+
+    gateway.liveness = Liveness.LivenessTracker(mqtt_con)
+    account = Account.Account("replay", Microtemp.ApiConnection("replay", "replay"), mqtt_con, gateway.liveness)
+    for serialnumber, data in initial_inventory(frames).items():
+        account.thermostats[serialnumber] = Microtemp.Thermostat.from_api(data)
+    gateway.accounts[:] = [account]
+    await gateway.publish_all(mqtt_con)
+    client.messages = client.bytes = 0
+    mqtt_con.suppressed_messages = 0
+
+    costs: List[float] = []
+    lag: List[float] = []
+    loop = asyncio.get_running_loop()
+    first_time = frames[0][0]
+    start = time.perf_counter()
+
+    for _ in range(repeat):
+        pass_start = loop.time()
+        for recorded_time, frame in frames:
+            if speed > 0:
+                due = pass_start + (recorded_time - first_time) / speed
+                delay = due - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                lag.append(max(0, loop.time() - due))
+
+            handle_start = time.perf_counter()
+            try:
+                await gateway.handle_websocket_msg(frame, mqtt_con, account)
+            except Exception:
+                gateway.logger.exception("Failed to handle replayed websocket message.")
+            costs.append(time.perf_counter() - handle_start)
+
+    return summarize(costs, time.perf_counter() - start, client, mqtt_con, lag)
+
+
+def report(summary: dict, baseline: dict = None):
+    print(f"frames: {summary['frames']}  elapsed: {summary['elapsed_s']:.2f} s  ({summary['frames_per_s']:.0f} frames/s)")
+    print(f"MQTT: {summary['mqtt_messages']} messages, {summary['mqtt_bytes']} bytes, {summary['mqtt_suppressed']} unchanged suppressed")
+    if summary["max_lag_ms"]:
+        print(f"max dispatch lag behind recorded pace: {summary['max_lag_ms']:.2f} ms")
+
+    for key in ("mean_us", "p50_us", "p95_us", "p99_us", "max_us"):
+        line = f"  {key[:-3]:>4}: {summary[key]:9.1f} us"
+        if baseline is not None and baseline.get(key):
+            line += f"  (baseline {baseline[key]:9.1f} us, {(summary[key] / baseline[key] - 1) * 100:+6.1f}%)"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("capture", nargs="+", help="Capture files written with --websocket_capture_file")
+    parser.add_argument("--speed", type=float, default=0, help="Replay speed relative to the recording, 0 for as fast as possible")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of passes over the capture")
+    parser.add_argument("--output", help="Write the summary as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against a summary written with --output")
+    args = parser.parse_args()
+
+    gateway.logger.setLevel(logging.WARNING)
+    frames = load_frames(args.capture)
+    if not frames:
+        print(f"No frames in {', '.join(args.capture)}")
+        return
+
+    summary = asyncio.run(replay(frames, args.speed, args.repeat))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    report(summary, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,5 +7,18 @@ MQTT_PASSWORD=$(bashio::config 'mqtt_password')
 CONFIG_PREFIX=$(bashio::config 'mqtt_config_topic_prefix')
 MICROMATIC_USERNAME=$(bashio::config 'micromatic_username')
 MICROMATIC_PASSWORD=$(bashio::config 'micromatic_password')
+COMMAND_COALESCE_WINDOW=$(bashio::config 'command_coalesce_window' '0.5')
+MAX_CONCURRENT_COMMANDS=$(bashio::config 'max_concurrent_commands' '4')
+TELEMETRY_INTERVAL=$(bashio::config 'telemetry_interval' '0')
 
-python3 /usr/src/hass_micromatic_gateway/main.py --mqtt_broker ${MQTT_BROKER} --mqtt_port ${MQTT_PORT} --mqtt_username ${MQTT_USERNAME} --mqtt_password ${MQTT_PASSWORD} --config_prefix ${CONFIG_PREFIX} --micromatic_username ${MICROMATIC_USERNAME} --micromatic_password ${MICROMATIC_PASSWORD}
\ No newline at end of file
+EXTRA_ARGS=()
+for index in $(bashio::config 'additional_accounts|keys'); do
+    ACCOUNT_USERNAME=$(bashio::config "additional_accounts[${index}].username")
+    ACCOUNT_PASSWORD=$(bashio::config "additional_accounts[${index}].password")
+    EXTRA_ARGS+=(--micromatic_account "${ACCOUNT_USERNAME}:${ACCOUNT_PASSWORD}")
+done
+if bashio::config.has_value 'mqtt_client_id'; then
+    EXTRA_ARGS+=(--mqtt_client_id "$(bashio::config 'mqtt_client_id')")
+fi
+
+python3 /usr/src/hass_micromatic_gateway/main.py --mqtt_broker ${MQTT_BROKER} --mqtt_port ${MQTT_PORT} --mqtt_username ${MQTT_USERNAME} --mqtt_password ${MQTT_PASSWORD} --config_prefix ${CONFIG_PREFIX} --micromatic_username ${MICROMATIC_USERNAME} --micromatic_password ${MICROMATIC_PASSWORD} --command_coalesce_window ${COMMAND_COALESCE_WINDOW} --max_concurrent_commands ${MAX_CONCURRENT_COMMANDS} --telemetry_interval ${TELEMETRY_INTERVAL} --cache_file /data/gateway_cache.json --session_file /data/session.json "${EXTRA_ARGS[@]}"
\ No newline at end of file
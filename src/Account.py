@@ -0,0 +1,55 @@
+import os
+import re
+from typing import Dict, Tuple
+
+from CommandDispatcher import CommandDispatcher
+from Liveness import LivenessTracker
+from Microtemp import ApiConnection, Thermostat, Websocket
+from MqttRelay import MqttConnector
+from Poller import FallbackPoller
+from ScheduleTimer import ScheduleTimer
+
+
+class Account:
+    """
+        One Micromatic account served by the gateway, with its own API session, websocket, thermostat
+        registry and the components acting on that registry. All accounts share the MQTT connection and
+        the event loop. Thermostat serial numbers are unique across accounts, so their MQTT topics never collide.
+    """
+
+    def __init__(self, name: str, api_con: ApiConnection, mqtt_con: MqttConnector, liveness: LivenessTracker, coalesce_window: float = 0.0,
+                 max_concurrency: int = 4, unhealthy_poll_interval: float = 60, healthy_poll_interval: float = 0,
+                 cache_file: str = None, capture_file: str = None):
+        self.name = name
+        self.api_con = api_con
+        self.cache_file = cache_file
+        self.capture_file = capture_file
+        self.thermostats: Dict[str, Thermostat] = {}
+        self.dispatcher = CommandDispatcher(api_con, self.thermostats, coalesce_window, max_concurrency,
+                                            on_failure=lambda serialnumber: mqtt_con.rollback_pending(serialnumber, self.thermostats))
+        self.schedule_timer = ScheduleTimer(mqtt_con, self.thermostats)
+        # After a websocket reconnect, one poll catches up on updates missed while disconnected.
+        self.websocket = Websocket(api_con, mqtt_con, on_reconnect=lambda: self.poller.poll_once())
+        self.poller = FallbackPoller(api_con, mqtt_con, self.websocket, self.schedule_timer, liveness, self.thermostats,
+                                     unhealthy_poll_interval, healthy_poll_interval)
+
+
+def parse_account(value: str) -> Tuple[str, str]:
+    # Accounts are given as username:password. Usernames are e-mail addresses, so the first colon separates them.
+    username, separator, password = value.partition(":")
+    if not separator or not username:
+        raise ValueError(f"Expected an account as username:password, got {value!r}")
+
+    return username, password
+
+
+def account_path(path: str, name: str, shared: bool) -> str:
+    """
+        Per-account variant of a session, cache or capture file path. A gateway serving a single account
+        keeps using path as is; with several accounts the sanitized account name is added before the extension.
+    """
+    if not path or not shared:
+        return path
+
+    root, extension = os.path.splitext(path)
+    return f"{root}.{re.sub(r'[^A-Za-z0-9_.@-]', '_', name)}{extension}"
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Set
+
+import Metrics
+from Microtemp import ApiConnection, Thermostat
+
+logger = logging.getLogger("MQTT_MicromaticGateway")
+
+
+@dataclass
+class DispatchResult:
+    ok: bool
+    timestamp: float
+    error: Optional[str] = None
+
+
+class CommandDispatcher:
+    """
+        Consumes thermostat commands from an asyncio queue and forwards them to the Micromatic API.
+
+        Commands are tuples of (serialnumber, changes) where changes maps Thermostat field names to
+        their new values. Commands for the same thermostat arriving within coalesce_window seconds of
+        the first one are merged, so only the last desired state is sent to the API.
+        on_failure is called with the serial number when a request fails and no newer command for
+        that thermostat is waiting to be sent.
+
+        Different thermostats are sent concurrently, up to max_concurrency requests at a time, while
+        commands for the same thermostat are applied in order with at most one request in flight.
+    """
+
+    def __init__(self, api_con: ApiConnection, thermostats: Dict[str, Thermostat], coalesce_window: float = 0.0, max_concurrency: int = 4,
+                 on_failure: Callable[[str], None] = None):
+        self.api_con = api_con
+        self.on_failure = on_failure
+        self.thermostats = thermostats
+        self.coalesce_window = coalesce_window
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.results: Dict[str, DispatchResult] = {}
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pending: Dict[str, dict] = {}
+        self._timers: Set[asyncio.Task] = set()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._deferred: Set[str] = set()
+        # Time the oldest command not yet sent was received, per thermostat.
+        self._received: Dict[str, float] = {}
+
+    def submit(self, serialnumber: str, changes: dict):
+        self._received.setdefault(serialnumber, time.perf_counter())
+        self.queue.put_nowait((serialnumber, changes))
+
+    def has_waiting(self, serialnumber: str) -> bool:
+        # True while a command for the thermostat is queued, coalescing or deferred, i.e. not sent yet.
+        return serialnumber in self._received
+
+    @property
+    def depth(self) -> int:
+        # Commands waiting to be sent, either queued, coalescing or deferred behind a request in flight.
+        return self.queue.qsize() + len(self._pending)
+
+    async def run(self):
+        try:
+            while True:
+                serialnumber, changes = await self.queue.get()
+                self._coalesce(serialnumber, changes)
+                self.queue.task_done()
+        finally:
+            for task in list(self._inflight.values()) + list(self._timers):
+                task.cancel()
+
+    def _coalesce(self, serialnumber: str, changes: dict):
+        pending = self._pending.get(serialnumber)
+        if pending is not None:
+            logger.debug("Coalescing command for thermostat with serial number %s.", serialnumber)
+            pending.update(changes)
+            return
+
+        self._pending[serialnumber] = dict(changes)
+        if self.coalesce_window <= 0:
+            self._release(serialnumber)
+            return
+
+        timer = asyncio.create_task(self._release_after_window(serialnumber))
+        self._timers.add(timer)
+        timer.add_done_callback(self._timers.discard)
+
+    async def _release_after_window(self, serialnumber: str):
+        await asyncio.sleep(self.coalesce_window)
+        self._release(serialnumber)
+
+    def _release(self, serialnumber: str):
+        if serialnumber in self._inflight:
+            # Keep collecting changes until the request in flight for this thermostat has completed.
+            self._deferred.add(serialnumber)
+            return
+
+        changes = self._pending.pop(serialnumber)
+        received = self._received.pop(serialnumber, None)
+        self._inflight[serialnumber] = asyncio.create_task(
+            self._send(serialnumber, changes, received), name=f"dispatch_{serialnumber}")
+
+    async def _send(self, serialnumber: str, changes: dict, received: float = None):
+        try:
+            async with self._semaphore:
+                await self.dispatch(serialnumber, changes)
+            if received is not None:
+                Metrics.COMMAND_LATENCY_SECONDS.observe(time.perf_counter() - received)
+            self.results[serialnumber] = DispatchResult(ok=True, timestamp=time.time())
+            logger.debug("Changed state of thermostat with serial number %s.", serialnumber)
+        except Exception as e:
+            self.results[serialnumber] = DispatchResult(ok=False, timestamp=time.time(), error=str(e))
+            logger.exception("Failed to change state of thermostat with serial number %s.", serialnumber)
+            # A newer command still waiting to be sent owns the pending state, so it is not rolled back.
+            if self.on_failure is not None and not self.has_waiting(serialnumber):
+                self.on_failure(serialnumber)
+        finally:
+            del self._inflight[serialnumber]
+            if serialnumber in self._deferred:
+                self._deferred.discard(serialnumber)
+                self._release(serialnumber)
+
+    async def dispatch(self, serialnumber: str, changes: dict):
+        thermostat = self.thermostats.get(serialnumber)
+        if thermostat is None:
+            logger.warning("Dropping command for unknown thermostat with serial number %s.", serialnumber)
+            return
+
+        await self.api_con.change_state(thermostat, changes)
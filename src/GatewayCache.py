@@ -0,0 +1,81 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Dict
+
+from Microtemp import Thermostat
+
+logger = logging.getLogger("MQTT_MicromaticGateway")
+
+
+def load_cache(path: str) -> dict:
+    """
+        Load the thermostat inventory and discovery config hashes saved by a previous run.
+        Returns an empty cache if the file does not exist or cannot be read.
+    """
+    if not path or not os.path.exists(path):
+        return {"thermostats": {}, "config_hashes": {}}
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        logger.warning("Unable to read gateway cache file %s. Starting without cache.", path, exc_info=True)
+        return {"thermostats": {}, "config_hashes": {}}
+
+    cache.setdefault("thermostats", {})
+    cache.setdefault("config_hashes", {})
+
+    return cache
+
+
+def dump_cache(thermostats: Dict[str, Thermostat], config_hashes: Dict[str, str]) -> str:
+    return json.dumps({
+        "thermostats": {key: thermostat.as_dict() for key, thermostat in thermostats.items()},
+        "config_hashes": config_hashes
+    })
+
+
+def write_cache(path: str, content: str) -> bool:
+    # Write to a temporary file first so a crash never leaves a truncated cache behind.
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except OSError:
+        logger.warning("Unable to write gateway cache file %s.", path, exc_info=True)
+        return False
+
+    return True
+
+
+def save_cache(path: str, thermostats: Dict[str, Thermostat], config_hashes: Dict[str, str]):
+    if not path:
+        return
+
+    if write_cache(path, dump_cache(thermostats, config_hashes)):
+        logger.debug("Saved %d thermostats to gateway cache file %s.", len(thermostats), path)
+
+
+async def save_periodically(path: str, thermostats: Dict[str, Thermostat], config_hashes: Dict[str, str], interval: float = 60):
+    """
+        Save the cache every interval seconds while the registry or the discovery configs have changed
+        since the last save, so updates from the websocket, the poller and commands survive a restart.
+    """
+    saved = None
+    while True:
+        await asyncio.sleep(interval)
+        content = dump_cache(thermostats, config_hashes)
+        if content != saved and write_cache(path, content):
+            saved = content
+            logger.debug("Saved %d thermostats to gateway cache file %s.", len(thermostats), path)
+
+
+def restore_thermostats(cache: dict, thermostats: Dict[str, Thermostat]):
+    for key, data in cache["thermostats"].items():
+        try:
+            thermostats[key] = Thermostat.from_api(data)
+        except (TypeError, ValueError):
+            logger.warning("Ignoring invalid cached thermostat with serial number %s.", key)
@@ -0,0 +1,53 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, Set
+
+from MqttRelay import MqttConnector
+
+logger = logging.getLogger("MQTT_MicromaticGateway")
+
+
+class LivenessTracker:
+    """
+        Tracks when each thermostat was last heard from on the websocket.
+        Availability is only published when a thermostat changes between online and offline; a periodic
+        sweep marks thermostats that have been silent for longer than timeout seconds as offline.
+    """
+
+    def __init__(self, mqtt_con: MqttConnector, timeout: float = 3600, sweep_interval: float = 60):
+        self.mqtt_con = mqtt_con
+        self.timeout = timeout
+        self.sweep_interval = sweep_interval
+        self.last_seen: Dict[str, float] = {}
+        self.online: Set[str] = set()
+
+    async def seen(self, serialnumber: str):
+        self.last_seen[serialnumber] = time.monotonic()
+        if serialnumber not in self.online:
+            self.online.add(serialnumber)
+            logger.info("Thermostat with serial number %s is online.", serialnumber)
+            await self.mqtt_con.publish_availability("online", serialnumber)
+
+    async def publish_all(self, serialnumbers: Iterable[str]):
+        # Publish the availability of every thermostat. Thermostats not tracked yet start out online.
+        now = time.monotonic()
+        for serialnumber in serialnumbers:
+            if serialnumber not in self.last_seen:
+                self.last_seen[serialnumber] = now
+                self.online.add(serialnumber)
+
+            state = "online" if serialnumber in self.online else "offline"
+            await self.mqtt_con.publish_availability(state, serialnumber)
+
+    async def sweep(self):
+        deadline = time.monotonic() - self.timeout
+        for serialnumber in [key for key in self.online if self.last_seen[key] < deadline]:
+            self.online.discard(serialnumber)
+            logger.info("No updates from thermostat with serial number %s in %d seconds. Marking it offline.", serialnumber, self.timeout)
+            await self.mqtt_con.publish_availability("offline", serialnumber)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            await self.sweep()
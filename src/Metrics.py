@@ -0,0 +1,287 @@
+import asyncio
+import cProfile
+import io
+import json
+import logging
+import pstats
+from bisect import bisect_left
+from functools import partial
+from typing import Callable, Dict, List, Tuple
+
+logger = logging.getLogger("MQTT_MicromaticGateway")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Counter:
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(key)} {value}" for key, value in self.values.items()]
+
+        return lines
+
+
+class Gauge:
+    """
+        Gauge read from a callback when rendered. The callback returns a number, or a dict mapping
+        label dicts (as tuples of (name, value) pairs) to numbers.
+    """
+
+    def __init__(self, name: str, description: str, callback: Callable):
+        self.name = name
+        self.description = description
+        self.callback = callback
+
+    def collect(self) -> Dict[Labels, float]:
+        value = self.callback()
+        if isinstance(value, dict):
+            return {tuple(key): item for key, item in value.items()}
+
+        return {(): value}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge"]
+        lines += [f"{self.name}{_format_labels(key)} {value}" for key, value in self.collect().items()]
+
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # Per label set: [count per bucket (last is +Inf), sum, count]
+        self.values: Dict[Labels, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            self.values[key] = entry
+
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def gauge(self, name: str, description: str, callback: Callable) -> Gauge:
+        return self.register(Gauge(name, description, callback))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            try:
+                lines += metric.render()
+            except Exception:
+                logger.exception("Failed to collect metric %s.", metric.name)
+
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+WEBSOCKET_MESSAGES = registry.register(Counter(
+    "micromatic_websocket_messages_total", "Websocket frames handled."))
+WEBSOCKET_PIPELINE_SECONDS = registry.register(Histogram(
+    "micromatic_websocket_pipeline_seconds", "Time from receiving a websocket frame, including its wait in the handler queue, to publishing the resulting MQTT state."))
+WEBSOCKET_RECONNECTS = registry.register(Counter(
+    "micromatic_websocket_reconnects_total", "Websocket reconnects since start."))
+MQTT_MESSAGES_EMITTED = registry.register(Counter(
+    "micromatic_mqtt_messages_emitted_total", "MQTT messages published."))
+MQTT_MESSAGES_SUPPRESSED = registry.register(Counter(
+    "micromatic_mqtt_messages_suppressed_total", "Unchanged MQTT messages skipped."))
+COMMAND_LATENCY_SECONDS = registry.register(Histogram(
+    "micromatic_command_latency_seconds", "Time from receiving an MQTT command to completing the API change request."))
+API_REQUEST_SECONDS = registry.register(Histogram(
+    "micromatic_api_request_seconds", "Duration of Micromatic API requests by endpoint and status."))
+
+
+class Profiler:
+    """
+        On-demand cProfile capture of the event loop thread, toggled through the metrics endpoint.
+    """
+
+    def __init__(self):
+        self._profile: cProfile.Profile = None
+
+    @property
+    def running(self) -> bool:
+        return self._profile is not None
+
+    def start(self) -> str:
+        if self._profile is not None:
+            return "Profiler already running.\n"
+
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        logger.info("Profiler started.")
+
+        return "Profiler started.\n"
+
+    def stop(self, limit: int = 40) -> str:
+        if self._profile is None:
+            return "Profiler not running.\n"
+
+        self._profile.disable()
+        output = io.StringIO()
+        pstats.Stats(self._profile, stream=output).sort_stats("cumulative").print_stats(limit)
+        self._profile = None
+        logger.info("Profiler stopped.")
+
+        return output.getvalue()
+
+
+profiler = Profiler()
+
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, enable_profiler: bool = False):
+    try:
+        request_line = await reader.readline()
+        # Drain the request headers.
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+
+        parts = request_line.decode("latin-1").split()
+        method = parts[0] if parts else ""
+        path = parts[1] if len(parts) > 1 else "/"
+        status = "200 OK"
+        content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+        if path == "/metrics":
+            body = registry.render()
+        elif enable_profiler and path in ("/profile/start", "/profile/stop"):
+            # Profiling changes the gateway's state, so it is not triggered by a plain GET such as a link prefetch.
+            if method != "POST":
+                status = "405 Method Not Allowed"
+                body = "Use POST.\n"
+            elif path == "/profile/start":
+                body = profiler.start()
+            else:
+                body = profiler.stop()
+        else:
+            status = "404 Not Found"
+            body = "Not found.\n"
+
+        payload = body.encode("utf-8")
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("latin-1"))
+        writer.write(payload)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(port: int, host: str = "127.0.0.1", enable_profiler: bool = False):
+    """
+        Serve /metrics in Prometheus text format. With enable_profiler, POST to /profile/start and
+        /profile/stop captures a profile.
+    """
+    server = await asyncio.start_server(partial(_handle_http, enable_profiler=enable_profiler), host, port)
+    logger.info("Serving metrics on %s port %d.", host, port)
+
+    async with server:
+        await server.serve_forever()
+
+
+def snapshot() -> Dict[str, float]:
+    # Flat view of counters, gauges and histogram counts/sums, used for the Home Assistant sensors.
+    values: Dict[str, float] = {}
+    for metric in registry.metrics.values():
+        if isinstance(metric, Histogram):
+            for key, (_, total, count) in metric.values.items():
+                suffix = "".join(f"_{label}" for _, label in key)
+                values[f"{metric.name}_count{suffix}"] = count
+                values[f"{metric.name}_avg{suffix}"] = round(total / count, 4) if count else 0
+        else:
+            items = metric.collect().items() if isinstance(metric, Gauge) else metric.values.items()
+            for key, value in items:
+                suffix = "".join(f"_{label}" for _, label in key)
+                values[f"{metric.name}{suffix}"] = value
+
+    return values
+
+
+async def publish_sensors(mqtt_con, interval: float):
+    """
+        Periodically publish a fixed set of gateway metrics as Home Assistant sensors over MQTT.
+    """
+    sensors = {
+        "micromatic_websocket_messages_total": ("Websocket messages", None),
+        "micromatic_websocket_reconnects_total": ("Websocket reconnects", None),
+        "micromatic_command_queue_depth": ("Command queue depth", None),
+        "micromatic_mqtt_messages_suppressed_total": ("Suppressed MQTT messages", None),
+        "micromatic_websocket_pipeline_seconds_avg": ("Websocket pipeline average", "s"),
+        "micromatic_command_latency_seconds_avg": ("Command latency average", "s")
+    }
+    state_topic = f"{mqtt_con.config_prefix}/sensor/micromatic_gateway/state"
+
+    for key, (name, unit) in sensors.items():
+        config = {
+            "name": f"Micromatic Gateway {name}",
+            "unique_id": f"micromatic_gateway_{key}",
+            "object_id": f"micromatic_gateway_{key}",
+            "state_topic": state_topic,
+            "value_template": f"{{{{ value_json.{key} | default(0) }}}}",
+            "availability_topic": mqtt_con.gateway_availability_topic,
+            "entity_category": "diagnostic",
+            "state_class": "measurement",
+            "device": {
+                "identifiers": "micromatic_gateway",
+                "manufacturer": "Micromatic",
+                "name": "Micromatic Gateway"
+            }
+        }
+        if unit is not None:
+            config["unit_of_measurement"] = unit
+        mqtt_con.publish(f"{mqtt_con.config_prefix}/sensor/micromatic_gateway_{key}/config", json.dumps(config))
+
+    while True:
+        values = snapshot()
+        mqtt_con.publish(state_topic, json.dumps({key: values.get(key, 0) for key in sensors}))
+        await asyncio.sleep(interval)
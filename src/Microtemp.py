@@ -1,17 +1,26 @@
 from __future__ import annotations
 import json
 import time
-from dataclasses import asdict, dataclass, field
-import requests
+from dataclasses import dataclass, field, fields
+import aiohttp
 import datetime
 import logging
+import os
 import websockets.client as websocket_client
 import random
+from bisect import bisect_right
+import heapq
 from math import floor
 from urllib.parse import quote
-from typing import Callable, Dict
+from typing import Callable, Dict, List, Optional, Tuple
 import asyncio
-from dacite import from_dict
+import Metrics
+from WebsocketCapture import FrameRecorder
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 
 
 from typing import TYPE_CHECKING
@@ -22,7 +31,65 @@ if TYPE_CHECKING:
 logger = logging.getLogger("MQTT_MicromaticGateway")
 
 
-@dataclass
+class ScheduleIndex:
+    """
+        Weekly schedule compiled into a sorted array of event offsets (seconds since Monday 00:00)
+        with the comfort/setback target temperature of each event precomputed.
+        The active target is the one of the latest event at or before the given time, wrapping
+        around to the last event of the week.
+    """
+
+    def __init__(self, schedule: dict):
+        self.schedule = schedule
+        self.offsets: List[int] = []
+        self.targets: List[float] = []
+
+        if not schedule:
+            return
+
+        comfort_temp = schedule['ComfortTemperatureRoom'] / 100
+        setback_temp = schedule['SetbackTemperatureRoom'] / 100
+        events = []
+        for day, item in enumerate(schedule['Days']):
+            for event in item["Events"]:
+                if not event["Active"]:
+                    continue
+
+                hours, minutes, seconds = (int(i) for i in event['Clock'].split(":"))
+                offset = day * 86400 + hours * 3600 + minutes * 60 + seconds
+                events.append((offset, comfort_temp if event['EventIsComfortTemp'] else setback_temp))
+
+        # Stable sort keeps the original order of events sharing the same clock time.
+        events.sort(key=lambda event: event[0])
+        self.offsets = [event[0] for event in events]
+        self.targets = [event[1] for event in events]
+
+    @staticmethod
+    def week_offset(now: datetime.datetime) -> int:
+        return now.weekday() * 86400 + now.hour * 3600 + now.minute * 60 + now.second
+
+    def target_at(self, now: datetime.datetime) -> Optional[float]:
+        # Returns None if the schedule has no active events.
+        if not self.offsets:
+            return None
+
+        position = bisect_right(self.offsets, self.week_offset(now))
+
+        return self.targets[position - 1]
+
+    def seconds_until_next_event(self, now: datetime.datetime) -> Optional[float]:
+        # Returns None if the schedule has no active events.
+        if not self.offsets:
+            return None
+
+        offset = self.week_offset(now)
+        position = bisect_right(self.offsets, offset)
+        next_offset = self.offsets[position] if position < len(self.offsets) else self.offsets[0] + 7 * 86400
+
+        return next_offset - offset - now.microsecond / 1e6
+
+
+@dataclass(slots=True)
 class Thermostat:
     SerialNumber: str
     GroupName: str
@@ -53,94 +120,292 @@ class Thermostat:
     LosTempFrost: int
     IdentifyThermo: bool
     UtcOffset: int
-    isChanged: bool = field(default=False, repr=False, init=False)
     Schedule: dict = field(default_factory=dict)
+    _schedule_index: Optional[ScheduleIndex] = field(default=None, init=False, repr=False, compare=False)
+    _schedule_json: Optional[Tuple[dict, str]] = field(default=None, init=False, repr=False, compare=False)
 
-    async def to_hass_state(self):
+    @property
+    def schedule_index(self) -> ScheduleIndex:
+        """
+            Compiled lookup index for the weekly schedule. Rebuilt only when the Schedule attribute
+            is replaced with a different object.
+        """
+        index = self._schedule_index
+        if index is None or index.schedule is not self.Schedule:
+            index = ScheduleIndex(self.Schedule)
+            self._schedule_index = index
+
+        return index
+
+    @classmethod
+    def from_api(cls, data: dict) -> Thermostat:
+        """
+            Build a Thermostat from an API/websocket thermostat object.
+            Only the fields used by the gateway are type checked.
+        """
+        validate_thermostat_data(data)
+
+        return cls(**{name: data[name] for name in THERMOSTAT_FIELDS if name in data})
+
+    def update_from_api(self, data: dict):
+        """
+            Update the thermostat in place from an API/websocket thermostat object.
+            The Schedule object (and its compiled index) is kept if the schedule is unchanged.
+        """
+        validate_thermostat_data(data)
+
+        for name in THERMOSTAT_FIELDS:
+            if name in data and name != "Schedule":
+                setattr(self, name, data[name])
+
+        schedule = data.get("Schedule")
+        if schedule is not None and schedule != self.Schedule:
+            self.Schedule = schedule
+
+    def hass_state(self, changes: dict = None) -> dict:
+        # Home Assistant climate state, optionally as it will be once changes are applied.
+        changes = changes or {}
         modes = {
             1: "auto",
             3: "heat",
             5: "off"
         }
-        mode = modes[self.RegulationMode]
-        target_temp = self.ManuelRoomTemperature / 100
+        mode = modes[changes.get("RegulationMode", self.RegulationMode)]
+        target_temp = changes.get("ManuelRoomTemperature", self.ManuelRoomTemperature) / 100
         curr_temp = self.TemperatureRoom / 100
-        event_on_previous_day = True
 
         if mode == "auto":
-            current_day = datetime.datetime.today().weekday()
-            for item in self.Schedule['Days'][current_day]["Events"]:
-                if not item["Active"]:
-                    continue
+            scheduled_temp = self.schedule_index.target_at(datetime.datetime.now())
+            if scheduled_temp is not None:
+                target_temp = scheduled_temp
 
-                now_time = datetime.datetime.now()
-                schedule_time = datetime.datetime.strptime(
-                    item['Clock'], '%H:%M:%S')
-                schedule_time = schedule_time.replace(
-                    day=now_time.day, month=now_time.month, year=now_time.year)
+        return {
+            "mode": mode,
+            "target_temperature": target_temp,
+            "current_temperature": curr_temp
+        }
 
-                if now_time >= schedule_time:
-                    target_temp = self.Schedule['ComfortTemperatureRoom'] / \
-                        100 if item['EventIsComfortTemp'] else self.Schedule['SetbackTemperatureRoom'] / 100
-                    event_on_previous_day = False
+    async def to_hass_state(self):
+        return json.dumps(self.hass_state())
 
+    def as_dict(self) -> dict:
+        # Shallow mapping in field order; Schedule is referenced, not copied.
+        return {name: getattr(self, name) for name in THERMOSTAT_FIELDS}
 
-            if event_on_previous_day:    
-                day = current_day - 1 if current_day - 1 >= 0 else 6
-                for item in reversed(self.Schedule['Days'][day]["Events"]):
-                    if not item["Active"]:
-                        continue
+    def diff(self, changes: dict) -> dict:
+        # Returns the subset of changes that differ from the current state.
+        return {key: value for key, value in changes.items() if getattr(self, key) != value}
 
-                    target_temp = self.Schedule['ComfortTemperatureRoom'] / \
-                        100 if item['EventIsComfortTemp'] else self.Schedule['SetbackTemperatureRoom'] / 100
-                    break
-                    
+    def to_change_payload(self, changes: dict = None) -> str:
+        """
+            Serialize the thermostat with changes applied as the body of a change request.
+            The Schedule (always the last field) is serialized once per schedule and spliced in.
+        """
+        if self._schedule_json is None or self._schedule_json[0] is not self.Schedule:
+            self._schedule_json = (self.Schedule, json.dumps(self.Schedule))
+
+        body = self.as_dict()
+        del body["Schedule"]
+        if changes:
+            body.update(changes)
+
+        return f'{json.dumps(body)[:-1]}, "Schedule": {self._schedule_json[1]}}}'
+
+
+# API fields of Thermostat in declaration order.
+THERMOSTAT_FIELDS = tuple(item.name for item in fields(Thermostat) if item.init)
+
+# Fields that affect the state published to Home Assistant.
+HASS_STATE_FIELDS = ("RegulationMode", "ManuelRoomTemperature", "TemperatureRoom", "Schedule")
+
+# Fields the gateway reads, and the types they must have.
+_VALIDATED_FIELDS = {
+    "SerialNumber": str,
+    "RegulationMode": int,
+    "ManuelRoomTemperature": int,
+    "TemperatureRoom": int,
+    "Schedule": dict
+}
+
+
+def validate_thermostat_data(data: dict):
+    for name, expected_type in _VALIDATED_FIELDS.items():
+        if name in data and not isinstance(data[name], expected_type):
+            raise ValueError(f"Invalid thermostat field {name}: expected {expected_type.__name__}, got {type(data[name]).__name__}.")
+
+    if "SerialNumber" not in data:
+        raise ValueError("Thermostat object is missing SerialNumber.")
+
+
+def parse_notification(message) -> List[dict]:
+    """
+        Extract the thermostat objects from a SignalR notification frame.
+        Each entry in the frame's M list is a JSON string holding one notification.
+    """
+    message = json_loads(message)
+    if not message:
+        return []
+
+    thermostats = []
+    for item in message.get('M', ()):
+        if isinstance(item, str):
+            item = json_loads(item)
+            if item.get('Thermostat'):
+                thermostats.append(item['Thermostat'])
+
+    return thermostats
+
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class RateLimiter:
+    """
+        Token bucket limiting the request rate to the Micromatic API.
+        Waiting requests are served by priority (lower value first) and in arrival order within a
+        priority, so interactive commands overtake queued background fetches.
+        A rate of 0 disables limiting.
+    """
+
+    def __init__(self, rate: float = 5, burst: int = 10):
+        self.rate = rate
+        self.burst = burst
+        self._tokens: float = burst
+        self._updated: float = None
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence: int = 0
+        self._timer: asyncio.TimerHandle = None
+        self.wait_count: Dict[int, int] = {}
+        self.wait_time: Dict[int, float] = {}
+        self.max_wait_time: Dict[int, float] = {}
+
+    def _refill(self, now: float):
+        if self._updated is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, priority: int = PRIORITY_BACKGROUND):
+        if self.rate <= 0:
+            return
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        self._refill(start)
+
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+        else:
+            future = loop.create_future()
+            heapq.heappush(self._waiters, (priority, self._sequence, future))
+            self._sequence += 1
+            self._schedule_drain(loop)
+            await future
+
+        waited = loop.time() - start
+        self.wait_count[priority] = self.wait_count.get(priority, 0) + 1
+        self.wait_time[priority] = self.wait_time.get(priority, 0) + waited
+        self.max_wait_time[priority] = max(self.max_wait_time.get(priority, 0), waited)
+
+    def _schedule_drain(self, loop: asyncio.AbstractEventLoop):
+        if self._timer is None:
+            delay = max(0, (1 - self._tokens) / self.rate)
+            self._timer = loop.call_later(delay, self._drain)
+
+    def _drain(self):
+        self._timer = None
+        loop = asyncio.get_running_loop()
+        self._refill(loop.time())
+
+        while self._waiters and self._tokens >= 1:
+            future = heapq.heappop(self._waiters)[2]
+            if future.done():
+                # The waiting request was cancelled.
+                continue
+            self._tokens -= 1
+            future.set_result(None)
 
-        new_state = {
-            "mode": mode,
-            "target_temperature": target_temp,
-            "current_temperature": curr_temp
-        }
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+
+        if self._waiters:
+            self._schedule_drain(loop)
 
-        return json.dumps(new_state)
+    def queue_depth(self) -> Dict[int, int]:
+        depth: Dict[int, int] = {}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                depth[priority] = depth.get(priority, 0) + 1
 
-    def as_dict(self):
-        instance = asdict(self)
-        instance.pop("isChanged")
+        return depth
 
-        return instance
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth(),
+            "wait_count": dict(self.wait_count),
+            "wait_time": dict(self.wait_time),
+            "max_wait_time": dict(self.max_wait_time)
+        }
 
 
 class ApiConnection:
 
-    def __init__(self, username: str, password: str) -> None:
+    def __init__(self, username: str, password: str, request_timeout: float = 30, max_connections: int = 10,
+                 session_file: str = None, session_lifetime: float = 86400, session_renew_margin: float = 600,
+                 rate_limit: float = 5, rate_burst: int = 10, base_url: str = "https://min.microtemp.no") -> None:
         self.username = username
         self.password = password
         self.connected = False
+        self.session_id: str = None
+        self.session_created: float = 0
+        self.session_file = session_file
+        self.session_lifetime = session_lifetime
+        self.session_renew_margin = session_renew_margin
+        self._auth_lock = asyncio.Lock()
+        self.limiter = RateLimiter(rate_limit, rate_burst)
+        self.base_url = base_url.rstrip("/")
+        self.request_timeout = request_timeout
+        self.max_connections = max_connections
+        self._session: aiohttp.ClientSession = None
         self._headers = {
             "Accept": "application/json, */*",
-            "Accept-Encoding": "gzip, deflate, br",
             "Accept-Language": "nb-NO,nb;q=0.9,no-NO;q=0.8,no;q=0.6,nn-NO;q=0.5,nn;q=0.4,en-US;q=0.3,en",
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
             "Content-Type": "application/json; charset=utf-8"
         }
 
-    def authenticate(self):
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """
+            Pooled keep-alive HTTP session shared by all requests to the Microtemp API.
+            Created lazily so it is bound to the running event loop.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+            timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self._headers)
+
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def authenticate(self):
         logger.debug("Authenticating to Micromatic API.")
 
-        auth_url: str = "https://min.microtemp.no/api/authenticate/user"
+        auth_url: str = f"{self.base_url}/api/authenticate/user"
         payload: dict = {
             "Application": 0,
             "Email": self.username,
             "Password": self.password
         }
 
-        response = requests.post(auth_url, data=json.dumps(
-            payload), headers=self._headers)
-        json_response = response.json()
+        async with self.session.post(auth_url, data=json.dumps(payload)) as response:
+            json_response = await response.json(content_type=None)
 
-        if response.status_code != 200 or json_response['ErrorCode'] != 0:
+        if response.status != 200 or json_response['ErrorCode'] != 0:
             raise RuntimeError("Microtemp API authentication failed.")
 
         self.session_id = json_response['SessionId']
@@ -152,10 +417,108 @@ class ApiConnection:
         self.language = json_response['Language']
         self.accepted_toc = json_response['AcceptedTOC']
         self.connected = True
+        self.session_created = time.time()
+        self._save_session()
 
-        logger.info("Connected to Micromatic API.")
+        logger.info("Connected to Micromatic API as %s.", self.username)
 
-    async def get(self, url: str, params: dict = None) -> dict:
+    def load_session(self) -> bool:
+        """
+            Restore the session ID saved by a previous run, so a restart can skip the login call.
+            Returns True if a session that has not expired was loaded.
+        """
+        if not self.session_file or not os.path.exists(self.session_file):
+            return False
+
+        try:
+            with open(self.session_file, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            logger.warning("Unable to read session file %s.", self.session_file, exc_info=True)
+            return False
+
+        if saved.get("username") != self.username or self._session_expiring(saved.get("created", 0)):
+            return False
+
+        self.session_id = saved["session_id"]
+        self.session_created = saved["created"]
+        self.connected = True
+        logger.info("Reusing saved Micromatic API session.")
+
+        return True
+
+    def _save_session(self):
+        if not self.session_file:
+            return
+
+        try:
+            fd = os.open(self.session_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"username": self.username, "session_id": self.session_id, "created": self.session_created}, f)
+        except OSError:
+            logger.warning("Unable to write session file %s.", self.session_file, exc_info=True)
+
+    def _session_expiring(self, created: float) -> bool:
+        return time.time() - created > self.session_lifetime - self.session_renew_margin
+
+    async def ensure_authenticated(self):
+        # Renew the session ahead of its expiry instead of waiting for a 401.
+        if self.session_id is None or self._session_expiring(self.session_created):
+            await self.reauthenticate(self.session_id)
+
+    async def reauthenticate(self, stale_session_id: str):
+        """
+            Replace stale_session_id with a new session. Concurrent callers holding the same stale
+            session share a single login request.
+        """
+        async with self._auth_lock:
+            if self.session_id is not None and self.session_id != stale_session_id:
+                return
+
+            await self.authenticate()
+
+    async def _request(self, method: str, url: str, params: dict = None, data: str = None,
+                       priority: int = PRIORITY_BACKGROUND) -> dict:
+        """
+            Sends a single request on the pooled session once the rate limiter admits it.
+            If the first attempt returns 401 the client reauthenticates once and retries.
+            Raises RuntimeError if the request is still unsuccessful.
+        """
+        await self.limiter.acquire(priority)
+        await self.ensure_authenticated()
+        session_id = self.session_id
+        if params is not None and "sessionid" in params:
+            params["sessionid"] = session_id
+
+        start = time.perf_counter()
+        async with self.session.request(method, url, params=params, data=data) as response:
+            self._observe(start, response)
+            if response.status != 401:
+                return await self._handle_response(method, response)
+
+        await self.reauthenticate(session_id)
+        if params is not None and "sessionid" in params:
+            params["sessionid"] = self.session_id
+
+        await self.limiter.acquire(priority)
+        start = time.perf_counter()
+        async with self.session.request(method, url, params=params, data=data) as response:
+            self._observe(start, response)
+            return await self._handle_response(method, response)
+
+    @staticmethod
+    def _observe(start: float, response: aiohttp.ClientResponse):
+        Metrics.API_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=response.url.path, status=response.status)
+
+    async def _handle_response(self, method: str, response: aiohttp.ClientResponse) -> dict:
+        if not response.ok:
+            text = await response.text()
+            raise RuntimeError(
+                f"Unable to process {method} request to {response.url}. \n {response.status} {response.reason} \n {text}")
+
+        return await response.json(content_type=None)
+
+    async def get(self, url: str, params: dict = None, priority: int = PRIORITY_BACKGROUND) -> dict:
         """
             Async method for processing GET requests to the Microtemp API.
             If not authenticated there will be made one attempt to reauthenticate.
@@ -166,29 +529,16 @@ class ApiConnection:
             Parameters:
                 - url [string]
                 - params [dict] HTTP get parameters
+                - priority [int] rate limiter priority, PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND
 
             return: HTTP reponse [dict] if get request was successful else RuntimeError is raised
         """
 
         logger.debug("Sending GET request to Micromatic API.\nURL: %s\nParams: %s", url, params)
-        response = requests.get(url=url, params=params, headers=self._headers)
-
-        if not response.ok:
-            if response.status_code == 401:
-                self.authenticate()
-                response = requests.get(
-                    url=url, params=params, headers=self._headers)
-                if not response.ok:
-                    raise RuntimeError(
-                        f"Unable to process GET request to {response.url}. \n {response.status_code} {response.reason} \n {response.text}")
-
-            else:
-                raise RuntimeError(
-                    f"Unable to process GET request to {response.url}. \n {response.status_code} {response.reason} \n {response.text}")
 
-        return response.json()
+        return await self._request("GET", url, params=params, priority=priority)
 
-    async def post(self, url: str, payload: dict, params: dict = None) -> dict:
+    async def post(self, url: str, payload: dict, params: dict = None, priority: int = PRIORITY_BACKGROUND) -> dict:
         """
             Async method for processing POST requests to the Microtemp API.
             If not authenticated there will be made one attempt to reauthenticate.
@@ -199,29 +549,14 @@ class ApiConnection:
             Parameters:
                 - url [string]
                 - payload [dict] - POST request payload
+                - priority [int] rate limiter priority, PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND
 
             return: HTTP reponse [dict] if POST request was successful else RuntimeError is raised
         """
 
         logger.debug("Sending POST request to Micromatic API.\nURL: %s\nParams: %s\nPayload: %s", url, params, payload)
 
-        response = requests.post(
-            url=url, data=payload, headers=self._headers, params=params)
-
-        if not response.ok:
-            if response.status_code == 401:
-                self.authenticate()
-                response = requests.post(
-                    url=url, data=payload, headers=self._headers, params=params)
-                if not response.ok:
-                    raise RuntimeError(
-                        f"Unable to process POST request to {response.url}. \n {response.status_code} {response.reason} \n {response.text}")
-
-            else:
-                raise RuntimeError(
-                    f"Unable to process POST request to {response.url}. \n {response.status_code} {response.reason} \n {response.text}")
-
-        return response.json()
+        return await self._request("POST", url, params=params, data=payload, priority=priority)
 
     async def negotiate(self) -> dict:
         """
@@ -229,7 +564,7 @@ class ApiConnection:
             Returns dictionary with websocket connection details (including connection token) that will be used to initiate
             websocket instance.
         """
-        url = "https://min.microtemp.no/gatewaynotification/negotiate"
+        url = f"{self.base_url}/gatewaynotification/negotiate"
         params = {
             "clientProtocol": 2.1,
             "_": round(time.time())
@@ -237,10 +572,24 @@ class ApiConnection:
 
         return await self.get(url, params)
 
-    async def change_state(self, thermostat: Thermostat):
+    async def change_state(self, thermostat: Thermostat, changes: dict = None):
+        """
+            Send the thermostat state with changes applied to the Microtemp API.
+            Thermostat is expected to hold the last state confirmed by the server. Changes that do not
+            differ from it are dropped, and no request is sent if nothing is left. After a successful
+            request the changes are applied to the thermostat, as they are now confirmed.
+
+            return: HTTP reponse [dict], or None if the request was skipped
+        """
         serialnumber = thermostat.SerialNumber
-        payload = json.dumps(thermostat.as_dict())
-        url = "https://min.microtemp.no/api/thermostat/change"
+        if changes is not None:
+            changes = thermostat.diff(changes)
+            if not changes:
+                logger.debug("Thermostat with serial number %s is already in the requested state.", serialnumber)
+                return None
+
+        payload = thermostat.to_change_payload(changes)
+        url = f"{self.base_url}/api/thermostat/change"
 
         params = {
             "sessionid": self.session_id,
@@ -248,31 +597,19 @@ class ApiConnection:
         }
 
         logger.debug("Sending POST request to Micromatic API.\nURL: %s\nParams: %s\nPayload: %s", url, params, payload)
-        response = requests.post(
-            url=url, data=payload, headers=self._headers, params=params)
-
-        if not response.ok:
-            if response.status_code == 401:
-                self.authenticate()
-                params['sessionid'] = self.session_id
-                response = requests.post(
-                    url=url, data=payload, headers=self._headers, params=params)
-                if not response.ok:
-                    raise RuntimeError(
-                        f"Unable to process POST request to {response.url}. \n {response.status_code} {response.reason} \n {response.text}")
 
-            else:
-                raise RuntimeError(
-                    f"Unable to process POST request to {response.url}. \n {response.status_code} {response.reason} \n {response.text}")
+        response = await self._request("POST", url, params=params, data=payload, priority=PRIORITY_INTERACTIVE)
+        for key, value in (changes or {}).items():
+            setattr(thermostat, key, value)
 
-        return response.json()
+        return response
 
     async def get_thermostats(self) -> list:
         """
             Method to get information of the thermostats.
         """
         thermostats: list = []
-        url = "https://min.microtemp.no/api/thermostats"
+        url = f"{self.base_url}/api/thermostats"
         params = {
             "sessionid": self.session_id
         }
@@ -292,25 +629,86 @@ class ApiConnection:
         logger.debug("Fetching thermostats info from API.")
         response = await self.get_thermostats()
         for i in response:
-            thermo = from_dict(data_class=Thermostat, data=i)
-            thermostats[i['SerialNumber']] = thermo
+            if i['SerialNumber'] in thermostats:
+                thermostats[i['SerialNumber']].update_from_api(i)
+                logger.debug('Updated thermostat with serialnumber %s in registery.', i["SerialNumber"])
+                continue
+
+            try:
+                thermostats[i['SerialNumber']] = Thermostat.from_api(i)
+            except (TypeError, ValueError) as e:
+                logger.warning("Ignoring invalid thermostat with serial number %s: %s", i['SerialNumber'], e)
+                continue
             logger.debug('Found thermostat with serialnumber %s. Thermostat added to registery.', i["SerialNumber"])
 
 
 class Websocket:
-    def __init__(self, api_con: ApiConnection, mqtt_con: MqttConnector):
+    """
+        Supervises a single SignalR websocket connection to the Micromatic notification service.
+        Lost or idle connections are re-established with jittered exponential backoff, reusing the API
+        session. Incoming messages are handed to a separate task so handling never delays the next
+        receive. After every reconnect on_reconnect is called once to catch up on missed updates.
+    """
+
+    def __init__(self, api_con: ApiConnection, mqtt_con: MqttConnector, on_reconnect: Callable = None,
+                 idle_timeout: float = 900, min_backoff: float = 1, max_backoff: float = 300):
         self.api_con = api_con
         self.mqtt_con = mqtt_con
+        self.on_reconnect = on_reconnect
+        self.idle_timeout = idle_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.connected: bool = False
         self.reconnect_attempts: int = 0
-        self.last_reconnect_attempt: datetime.datetime = datetime.datetime.now()
-
-    async def connect_await_incoming(self, handle_websocket_msg: Callable):
+        self.reconnects: int = 0
+        self.last_message_time: float = None
+        self._messages: asyncio.Queue = asyncio.Queue()
+        self._catch_up_task: asyncio.Task = None
+        self._recorder: FrameRecorder = None
+
+    async def connect_await_incoming(self, handle_websocket_msg: Callable, capture_file: str = None):
+        # Optionally record every raw frame to capture_file for offline replay.
+        if capture_file:
+            self._recorder = FrameRecorder(capture_file)
+            logger.info("Recording websocket traffic to %s.", self._recorder.path)
+
+        handler_task = asyncio.create_task(self._handle_messages(handle_websocket_msg), name="websocket_handler_task")
+        connected_before = False
+
+        try:
+            while True:
+                try:
+                    await self._connect_and_receive(catch_up=connected_before)
+                except asyncio.exceptions.TimeoutError:
+                    logger.info("Websocket connection timed out.")
+                except Exception as e:
+                    logger.warning("Websocket connection failed: %s", e)
+
+                if self.connected:
+                    self.connected = False
+                    connected_before = True
+                    self.reconnects += 1
+                    Metrics.WEBSOCKET_RECONNECTS.inc()
+
+                delay = min(self.max_backoff, self.min_backoff * 2 ** self.reconnect_attempts)
+                delay = random.uniform(delay / 2, delay)
+                self.reconnect_attempts += 1
+                logger.info("Reconnecting to websocket in %.1f seconds. Attempts: %d", delay, self.reconnect_attempts)
+                await asyncio.sleep(delay)
+        finally:
+            handler_task.cancel()
+            if self._recorder is not None:
+                self._recorder.close()
+                self._recorder = None
+
+    async def _connect_and_receive(self, catch_up: bool):
         websocket_details = await self.api_con.negotiate()
         connection_token = websocket_details['ConnectionToken']
         quoted_token = quote(connection_token)
         session_id = self.api_con.session_id
         tid = floor(random.random() * 10) + 1
-        url = f"wss://min.microtemp.no/gatewaynotification/connect?transport=webSockets&clientProtocol=2.1&connectionToken={quoted_token}&tid={tid}"
+        websocket_base_url = self.api_con.base_url.replace("https://", "wss://", 1).replace("http://", "ws://", 1)
+        url = f"{websocket_base_url}/gatewaynotification/connect?transport=webSockets&clientProtocol=2.1&connectionToken={quoted_token}&tid={tid}"
 
         async with websocket_client.connect(url) as websocket:
             params = {
@@ -320,34 +718,48 @@ class Websocket:
             }
 
             # Notify server to start sending notifications on the websocket connection.
-            await self.api_con.get("https://min.microtemp.no/gatewaynotification/start", params)
+            await self.api_con.get(f"{self.api_con.base_url}/gatewaynotification/start", params)
 
             # Authenticate the client on the websocket by sending the session ID.
             await websocket.send(session_id)
             logger.debug("Connected to websocket url %s", url)
-            logger.info("Connected to Micromatic websocket.")
-            while True:
-                try:
-                    message = await asyncio.wait_for(websocket.recv(), 900)
-                    await handle_websocket_msg(message, self.mqtt_con)
-                except asyncio.exceptions.TimeoutError:
-                    if datetime.datetime.now() - self.last_reconnect_attempt <= datetime.timedelta(minutes=5):
-                        self.reconnect_attempts += 1
-                        self.last_reconnect_attempt = datetime.datetime.now()
-                    else:
-                        # Reset the attempt counter if more than 5 mins since last timeout.
-                        self.reconnect_attempts = 1
-                        self.last_reconnect_attempt = datetime.datetime.now()
-
-
-                    if self.reconnect_attempts > 5:
-                        logger.info("Unable to reconnect to websocket. Closing...")
-                        loop = asyncio.get_event_loop()
-                        await loop.shutdown_default_executor()
-                        await loop.stop()
-                        
-                    logger.info("Websocket connection timed out. Attempting to reconnect. Attempts: %d", self.reconnect_attempts)
-                    asyncio.create_task(self.connect_await_incoming(handle_websocket_msg), name="websocket_task")
-                    break
+            logger.info("Connected to Micromatic websocket as %s.", self.api_con.username)
+            self.connected = True
+            self.reconnect_attempts = 0
 
-    
+            if catch_up and self.on_reconnect is not None:
+                self._catch_up_task = asyncio.create_task(self._catch_up(), name="websocket_catch_up_task")
+
+            while True:
+                message = await asyncio.wait_for(websocket.recv(), self.idle_timeout)
+                self.last_message_time = time.monotonic()
+                if self._recorder is not None:
+                    self._recorder.record(message)
+                self._messages.put_nowait((time.perf_counter(), message))
+
+    @property
+    def queue_depth(self) -> int:
+        # Frames received but not yet handled.
+        return self._messages.qsize()
+
+    @property
+    def healthy(self) -> bool:
+        # Connected, and not silent for longer than the idle timeout.
+        if not self.connected:
+            return False
+
+        return self.last_message_time is None or time.monotonic() - self.last_message_time < self.idle_timeout
+
+    async def _catch_up(self):
+        try:
+            await self.on_reconnect()
+        except Exception:
+            logger.exception("Failed to fetch thermostat states after reconnecting to websocket.")
+
+    async def _handle_messages(self, handle_websocket_msg: Callable):
+        while True:
+            received, message = await self._messages.get()
+            try:
+                await handle_websocket_msg(message, self.mqtt_con, received=received)
+            except Exception:
+                logger.exception("Failed to handle websocket message.")
@@ -1,37 +1,93 @@
-from gmqtt import Client as MQTTClient
+from gmqtt import Client as MQTTClient, Message
+import asyncio
+import hashlib
 import logging
 import json
-from typing import Callable, Dict, List
+import uuid
+from typing import Callable, Dict, List, Tuple
 from Microtemp import Thermostat
+import Metrics
 
 logger = logging.getLogger("MQTT_MicromaticGateway")
 
+# Target temperature range in °C offered to Home Assistant and accepted in commands.
+MIN_TEMP = 12.0
+MAX_TEMP = 32.5
+
 class MqttConnector:
 
-    def __init__(self, broker: str, port: str, username: str, password: str, config_prefix: str):
+    def __init__(self, broker: str, port: str, username: str, password: str, config_prefix: str, pending_timeout: float = 10,
+                 client_id: str = None):
         self.broker = broker
         self.port = port
         self.username = username
         self.password = password
         self.client = None
+        # Must be unique per broker, otherwise gateways sharing a broker disconnect each other.
+        self.client_id = client_id or f"micromatic_gateway_{uuid.uuid4().hex[:12]}"
         self.config_prefix = config_prefix
         self.subsriptions: List[str] = []
         self.availability_topics: Dict[str, str] = {}
         self.command_topics: Dict[str, str] = {}
         self.state_topics: Dict[str, str] = {}
+        # Reverse index from command topic to thermostat serial number, used to route incoming commands.
+        self.command_routes: Dict[str, str] = {}
+        self.command_topic_filter = f"{config_prefix}/climate/+/set"
+        # Last payload published per topic, used to skip publishing identical messages.
+        self.last_payloads: Dict[str, str] = {}
+        self.emitted_messages: int = 0
+        self.suppressed_messages: int = 0
+        # Hash of the last discovery config published per config topic. Persisted between restarts.
+        self.config_hashes: Dict[str, str] = {}
+        # Home Assistant publishes "online" here when it starts and needs the discovery configs again.
+        self.status_topic = f"{config_prefix}/status"
+        # Availability of the gateway itself. Set to offline by the broker through the last will if the gateway dies.
+        self.gateway_availability_topic = f"{config_prefix}/micromatic_gateway/available"
+        self.connected = asyncio.Event()
+        # Commanded states published before the server confirmed them, with their rollback timers.
+        self.pending_timeout = pending_timeout
+        self.pending_states: Dict[str, Tuple[dict, asyncio.TimerHandle]] = {}
 
     def on_connect(self, client, flags, rc, properties):
         logger.info("Connected to MQTT broker.")
+        # The broker may have lost retained messages while we were disconnected, so republish everything.
+        self.last_payloads.clear()
+        self.publish(self.gateway_availability_topic, "online")
+        self.connected.set()
+
+    def reset_publish_cache(self):
+        self.last_payloads.clear()
+        self.config_hashes.clear()
+
+    def publish(self, topic: str, payload: str, retain: bool = True) -> bool:
+        """
+            Publish payload to topic unless it is identical to the last payload published to that topic.
+            Returns True if the message was published.
+        """
+        if self.last_payloads.get(topic) == payload:
+            self.suppressed_messages += 1
+            Metrics.MQTT_MESSAGES_SUPPRESSED.inc()
+            logger.debug("Skipped publishing unchanged payload to mqtt topic %s.", topic)
+            return False
+
+        self.client.publish(topic, payload=payload, qos=0, retain=retain)
+        self.last_payloads[topic] = payload
+        self.emitted_messages += 1
+        Metrics.MQTT_MESSAGES_EMITTED.inc()
+
+        return True
 
     def on_disconnect(self, client, packet, exc=None):
         logger.info("Disconnected from MQTT broker.")
+        self.connected.clear()
 
     def on_subscribe(self, client, mid, qos, properties):
         # Callback when subscribing.
         pass
 
     async def connect(self, on_message: Callable):
-        self.client = MQTTClient("client-id-pub")
+        will_message = Message(self.gateway_availability_topic, "offline", qos=1, retain=True)
+        self.client = MQTTClient(self.client_id, will_message=will_message)
 
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
@@ -39,11 +95,13 @@ class MqttConnector:
 
         self.client.set_auth_credentials(self.username, self.password)
         await self.client.connect(self.broker, self.port)
-        
+        self.client.subscribe(self.status_topic)
+        self.client.subscribe(self.command_topic_filter)
+        self.subsriptions = [self.status_topic, self.command_topic_filter]
 
         return self
     
-    async def mqtt_publish_configs(self, thermostats: Thermostat):
+    async def mqtt_publish_configs(self, thermostats: Dict[str, Thermostat]):
 
         for item in thermostats:
 
@@ -55,9 +113,14 @@ class MqttConnector:
             self.availability_topics[thermostats[item].SerialNumber] = availability_topic
             self.state_topics[thermostats[item].SerialNumber] = state_topic
             self.command_topics[thermostats[item].SerialNumber] = command_topic
+            self.command_routes[command_topic] = thermostats[item].SerialNumber
 
             payload = {
-                "availability_topic": f"{availability_topic}",
+                "availability": [
+                    {"topic": f"{self.gateway_availability_topic}"},
+                    {"topic": f"{availability_topic}"}
+                ],
+                "availability_mode": "all",
                 "current_temperature_template": "{{ value_json.current_temperature }}",
                 "current_temperature_topic": f"{state_topic}",
                 "device": {
@@ -68,8 +131,8 @@ class MqttConnector:
                 },
                 "initial": 22,
                 "icon": "mdi:thermostat",
-                "max_temp": 32.5,
-                "min_temp": 12.0,
+                "max_temp": MAX_TEMP,
+                "min_temp": MIN_TEMP,
                 "mode_command_topic": f"{command_topic}",
                 "mode_command_template": f"{{% set command = {{\"unique_id\": \"{thermostats[item].SerialNumber}\", \"mode\": value }} %}} {{{{ command|to_json }}}}",
                 "mode_state_template": "{{ value_json.mode }}",
@@ -88,39 +151,79 @@ class MqttConnector:
             }
             payload = json.dumps(payload)
 
+            config_hash = hashlib.sha1(payload.encode()).hexdigest()
+            if self.config_hashes.get(topic) == config_hash:
+                logger.debug("Thermostat config on mqtt topic %s is unchanged.", topic)
+                continue
+
             logger.info("Publishing thermostat config to mqtt topic %s", topic)
             logger.debug("Payload:\n%s", payload)
             self.client.publish(topic, payload, qos=0, retain=True)
-            self.client.subscribe(command_topic)
+            self.config_hashes[topic] = config_hash
 
     async def update_publish_state(self, serialnumber: str, thermostats: Dict[str, Thermostat]):
-        if serialnumber == "all":
-            for key in self.state_topics:
-                topic = self.state_topics[key]
-                thermostat = thermostats[key]
+        # "all" covers the thermostats in the given registry that have been announced to Home Assistant.
+        serialnumbers = [key for key in thermostats if key in self.state_topics] if serialnumber == "all" else [serialnumber]
 
-                hass_state = await thermostat.to_hass_state()
-                logger.debug("Published updated state to mqtt topic %s. New state:\n%s", topic, hass_state)
-                self.client.publish(topic, payload=hass_state, qos=0)
-        else:
-            topic = self.state_topics[serialnumber]
-            thermostat = thermostats[serialnumber]
+        for key in serialnumbers:
+            if key in self.pending_states:
+                # Keep showing the commanded state until it is confirmed or rolled back.
+                continue
 
-            hass_state = await thermostat.to_hass_state()
-            logger.debug("Published updated state to mqtt topic %s. New state:\n%s", topic, hass_state)
-            self.client.publish(topic, payload=hass_state, qos=0, retain=True)
+            topic = self.state_topics[key]
+            thermostat = thermostats[key]
 
+            hass_state = await thermostat.to_hass_state()
+            if self.publish(topic, hass_state):
+                logger.debug("Published updated state to mqtt topic %s. New state:\n%s", topic, hass_state)
 
     async def publish_availability(self, state: str, serialnumber: str):
-        if serialnumber == "all":
-            for key in self.availability_topics:
-                topic = self.availability_topics[key]
-                logger.debug("Published availability mqtt message to topic %s. Availability state: %s", topic, state)
-                self.client.publish(topic, payload=state, qos=0)
-
-        else:
-            topic = self.availability_topics[serialnumber]
-            logger.debug("Published availability mqtt message to topic %s. Availability state: %s", topic, state)
-            self.client.publish(topic, payload=state, qos=0)
+        serialnumbers = self.availability_topics if serialnumber == "all" else [serialnumber]
 
+        for key in serialnumbers:
+            topic = self.availability_topics[key]
+            if self.publish(topic, state):
+                logger.debug("Published availability mqtt message to topic %s. Availability state: %s", topic, state)
 
+    def publish_pending(self, serialnumber: str, thermostats: Dict[str, Thermostat], changes: dict):
+        """
+            Publish the state a thermostat will have once changes are applied, before the server has
+            confirmed it. Rolled back to the server state if not confirmed within pending_timeout seconds.
+        """
+        topic = self.state_topics.get(serialnumber)
+        if topic is None:
+            return
+
+        state = thermostats[serialnumber].hass_state(changes)
+        previous = self.pending_states.pop(serialnumber, None)
+        if previous is not None:
+            previous[1].cancel()
+
+        timer = asyncio.get_running_loop().call_later(self.pending_timeout, self.rollback_pending, serialnumber, thermostats)
+        self.pending_states[serialnumber] = (state, timer)
+        self.publish(topic, json.dumps(state))
+        logger.debug("Published pending state for thermostat with serial number %s.", serialnumber)
+
+    def reconcile_pending(self, serialnumber: str, thermostats: Dict[str, Thermostat]):
+        # Clear the pending state if the server state now matches the commanded mode and target temperature.
+        pending = self.pending_states.get(serialnumber)
+        if pending is None:
+            return
+
+        state = thermostats[serialnumber].hass_state()
+        if state["mode"] == pending[0]["mode"] and state["target_temperature"] == pending[0]["target_temperature"]:
+            pending[1].cancel()
+            del self.pending_states[serialnumber]
+            logger.debug("Pending state confirmed for thermostat with serial number %s.", serialnumber)
+
+    def rollback_pending(self, serialnumber: str, thermostats: Dict[str, Thermostat]):
+        pending = self.pending_states.pop(serialnumber, None)
+        if pending is None:
+            return
+
+        pending[1].cancel()
+        state = thermostats[serialnumber].hass_state()
+        if state["mode"] != pending[0]["mode"] or state["target_temperature"] != pending[0]["target_temperature"]:
+            logger.warning("Commanded state for thermostat with serial number %s was not confirmed. Rolling back.", serialnumber)
+
+        self.publish(self.state_topics[serialnumber], json.dumps(state))
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from typing import Dict, List
+
+from Microtemp import HASS_STATE_FIELDS, THERMOSTAT_FIELDS, ApiConnection, Thermostat, Websocket
+from Liveness import LivenessTracker
+from MqttRelay import MqttConnector
+from ScheduleTimer import ScheduleTimer
+
+logger = logging.getLogger("MQTT_MicromaticGateway")
+
+HEALTH_CHECK_INTERVAL = 10
+
+
+class FallbackPoller:
+    """
+        Polls the thermostat list over REST as a fallback for the websocket.
+        Polls every unhealthy_interval seconds while the websocket is down or stale and every
+        healthy_interval seconds while it is healthy (0 disables polling in that state).
+        Each response is diffed against the registry field by field and only thermostats whose
+        Home Assistant state changed are published.
+    """
+
+    def __init__(self, api_con: ApiConnection, mqtt_con: MqttConnector, websocket: Websocket, schedule_timer: ScheduleTimer,
+                 liveness: LivenessTracker, thermostats: Dict[str, Thermostat], unhealthy_interval: float = 60, healthy_interval: float = 0):
+        self.api_con = api_con
+        self.mqtt_con = mqtt_con
+        self.websocket = websocket
+        self.schedule_timer = schedule_timer
+        self.liveness = liveness
+        self.thermostats = thermostats
+        self.unhealthy_interval = unhealthy_interval
+        self.healthy_interval = healthy_interval
+        self.polls: int = 0
+
+    def _interval(self) -> float:
+        return self.healthy_interval if self.websocket.healthy else self.unhealthy_interval
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        last_poll = loop.time()
+
+        while True:
+            # Re-evaluate the websocket health regularly so the interval adapts without waiting a full period.
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+            interval = self._interval()
+            if interval <= 0 or loop.time() - last_poll < interval:
+                continue
+
+            last_poll = loop.time()
+            try:
+                await self.poll_once()
+            except Exception:
+                logger.exception("Failed to poll thermostats from Micromatic API.")
+
+    async def poll_once(self) -> List[str]:
+        """
+            Fetch all thermostats, update the registry and publish the ones that changed.
+            Returns the serial numbers whose Home Assistant state changed.
+        """
+        self.polls += 1
+        response = await self.api_con.get_thermostats()
+        changed: List[str] = []
+        added: List[str] = []
+        seen: List[str] = []
+
+        for data in response:
+            serialnumber = data.get('SerialNumber')
+            thermostat = self.thermostats.get(serialnumber)
+            if thermostat is None:
+                try:
+                    self.thermostats[serialnumber] = Thermostat.from_api(data)
+                except (TypeError, ValueError) as e:
+                    logger.warning("Ignoring invalid polled thermostat with serial number %s: %s", serialnumber, e)
+                    continue
+                logger.info("Found new thermostat with serial number %s while polling.", serialnumber)
+                added.append(serialnumber)
+                changed.append(serialnumber)
+                continue
+
+            fields = [name for name in THERMOSTAT_FIELDS if name in data and data[name] != getattr(thermostat, name)]
+            if fields:
+                try:
+                    thermostat.update_from_api(data)
+                except (TypeError, ValueError) as e:
+                    logger.warning("Ignoring invalid polled thermostat with serial number %s: %s", serialnumber, e)
+                    continue
+            seen.append(serialnumber)
+            if any(name in HASS_STATE_FIELDS for name in fields):
+                changed.append(serialnumber)
+
+        if added:
+            await self.mqtt_con.mqtt_publish_configs(self.thermostats)
+            # Discovery requires the thermostat's own availability as well, so new thermostats start out online.
+            await self.liveness.publish_all(added)
+
+        # A thermostat in the response is alive even if nothing reaches us over the websocket.
+        for serialnumber in seen:
+            await self.liveness.seen(serialnumber)
+
+        for serialnumber in changed:
+            await self.mqtt_con.update_publish_state(serialnumber, self.thermostats)
+            self.schedule_timer.reschedule(serialnumber)
+
+        logger.debug("Polled %d thermostats from Micromatic API. %d changed.", len(response), len(changed))
+
+        return changed
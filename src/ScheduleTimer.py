@@ -0,0 +1,103 @@
+import asyncio
+import datetime
+import heapq
+import logging
+from typing import Dict, List, Tuple
+
+from Microtemp import Thermostat
+from MqttRelay import MqttConnector
+
+logger = logging.getLogger("MQTT_MicromaticGateway")
+
+# Seconds to wait past a schedule boundary so the lookup falls on the new event.
+BOUNDARY_MARGIN = 0.1
+# Deadlines closer than this to the live one are the same schedule boundary.
+DEADLINE_TOLERANCE = 1.0
+
+
+class ScheduleTimer:
+    """
+        Republishes the state of thermostats in auto mode exactly when their schedule switches between
+        comfort and setback, so Home Assistant shows the new target temperature without polling.
+
+        Keeps a heap of (deadline, generation, serialnumber) with one live entry per thermostat.
+        Rescheduling a thermostat to the same boundary keeps its live entry. Only when the deadline
+        moves is its generation bumped, which invalidates its older heap entries.
+    """
+
+    def __init__(self, mqtt_con: MqttConnector, thermostats: Dict[str, Thermostat]):
+        self.mqtt_con = mqtt_con
+        self.thermostats = thermostats
+        self._heap: List[Tuple[float, int, str]] = []
+        self._generations: Dict[str, int] = {}
+        # Deadline of the live heap entry per thermostat.
+        self._deadlines: Dict[str, float] = {}
+        self._wakeup = asyncio.Event()
+
+    def reschedule(self, serialnumber: str):
+        deadline = None
+        thermostat = self.thermostats.get(serialnumber)
+        if thermostat is not None and thermostat.RegulationMode == 1:
+            delay = thermostat.schedule_index.seconds_until_next_event(datetime.datetime.now())
+            if delay is not None:
+                deadline = asyncio.get_running_loop().time() + delay + BOUNDARY_MARGIN
+
+        current = self._deadlines.get(serialnumber)
+        if current is None and deadline is None:
+            return
+        if current is not None and deadline is not None and abs(current - deadline) < DEADLINE_TOLERANCE:
+            return
+
+        generation = self._generations.get(serialnumber, 0) + 1
+        self._generations[serialnumber] = generation
+        if deadline is None:
+            del self._deadlines[serialnumber]
+            return
+
+        self._deadlines[serialnumber] = deadline
+        heapq.heappush(self._heap, (deadline, generation, serialnumber))
+        if len(self._heap) > 2 * len(self._deadlines) + 16:
+            # Drop stale entries left behind by deadlines that moved.
+            self._heap = [entry for entry in self._heap if not self._is_stale(entry)]
+            heapq.heapify(self._heap)
+        logger.debug("Next schedule boundary for thermostat with serial number %s in %.0f seconds.", serialnumber, delay)
+
+        if self._heap[0][2] == serialnumber:
+            self._wakeup.set()
+
+    def reschedule_all(self):
+        for serialnumber in self.thermostats:
+            self.reschedule(serialnumber)
+
+    def _is_stale(self, entry: Tuple[float, int, str]) -> bool:
+        return self._generations.get(entry[2]) != entry[1]
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            self._wakeup.clear()
+            while self._heap and self._is_stale(self._heap[0]):
+                heapq.heappop(self._heap)
+
+            timeout = max(0, self._heap[0][0] - loop.time()) if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+                continue
+            except asyncio.exceptions.TimeoutError:
+                pass
+
+            now = loop.time()
+            while self._heap and self._heap[0][0] <= now:
+                entry = heapq.heappop(self._heap)
+                if self._is_stale(entry):
+                    continue
+
+                serialnumber = entry[2]
+                del self._deadlines[serialnumber]
+                logger.debug("Schedule boundary reached for thermostat with serial number %s.", serialnumber)
+                try:
+                    await self.mqtt_con.update_publish_state(serialnumber, self.thermostats)
+                except Exception:
+                    logger.exception("Failed to publish scheduled state of thermostat with serial number %s.", serialnumber)
+                self.reschedule(serialnumber)
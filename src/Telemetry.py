@@ -0,0 +1,205 @@
+import asyncio
+import json
+import logging
+import time
+from array import array
+from typing import Dict, Optional
+
+from Microtemp import Thermostat
+from MqttRelay import MqttConnector
+
+logger = logging.getLogger("MQTT_MicromaticGateway")
+
+# Thermostat fields kept in the history, all reported by the API as integers.
+TELEMETRY_FIELDS = ("TemperatureRoom", "TemperatureFloor", "RelayOn2Days", "RelayOn30Days", "RelayOn365Days")
+TEMPERATURE_FIELDS = ("TemperatureRoom", "TemperatureFloor")
+INT32_RANGE = (-2 ** 31, 2 ** 31 - 1)
+
+# Sensor key -> (name, unit, device class) for the per-thermostat telemetry sensors.
+# Relay figures are passed on in the unit the API reports them in.
+TELEMETRY_SENSORS = {
+    "room_temperature_min": ("Room temperature min", "°C", "temperature"),
+    "room_temperature_mean": ("Room temperature mean", "°C", "temperature"),
+    "room_temperature_max": ("Room temperature max", "°C", "temperature"),
+    "floor_temperature_min": ("Floor temperature min", "°C", "temperature"),
+    "floor_temperature_mean": ("Floor temperature mean", "°C", "temperature"),
+    "floor_temperature_max": ("Floor temperature max", "°C", "temperature"),
+    "relay_on_2_days": ("Relay on 2 days", None, None),
+    "relay_on_30_days": ("Relay on 30 days", None, None),
+    "relay_on_365_days": ("Relay on 365 days", None, None),
+}
+
+
+class TelemetryBuffer:
+    """
+        Fixed size ring buffer of telemetry samples for one thermostat. Timestamps and each field live
+        in their own preallocated array, so memory use does not grow with the number of updates.
+        Once full, every new sample overwrites the oldest one. A field that is missing or out of range
+        repeats its value from the previous sample.
+    """
+
+    def __init__(self, capacity: int = 2048):
+        self.capacity = capacity
+        self.times = array("d", bytes(8 * capacity))
+        self.values: Dict[str, array] = {name: array("i", bytes(4 * capacity)) for name in TELEMETRY_FIELDS}
+        self.count: int = 0
+        self._next: int = 0
+
+    def append(self, timestamp: float, thermostat: Thermostat) -> bool:
+        """
+            Store a sample of thermostat. Returns False if a field is missing and there is no previous
+            sample to take it from.
+        """
+        previous = (self._next - 1) % self.capacity if self.count else None
+        sample = []
+        for name, values in self.values.items():
+            value = getattr(thermostat, name, None)
+            if not isinstance(value, int) or not INT32_RANGE[0] <= value <= INT32_RANGE[1]:
+                if previous is None:
+                    return False
+                value = values[previous]
+            sample.append(value)
+
+        index = self._next
+        self.times[index] = timestamp
+        for values, value in zip(self.values.values(), sample):
+            values[index] = value
+
+        self._next = (index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+        return True
+
+    def aggregate(self, since: float, until: float) -> Optional[Dict[str, tuple]]:
+        """
+            Time weighted mean, min and max of every field between since and until, as
+            {field: (min, mean, max)}. Each sample holds until the next one, so the last sample before
+            since counts from since on. Returns None if there are no samples before until.
+        """
+        minimum = {name: None for name in TELEMETRY_FIELDS}
+        maximum = dict(minimum)
+        weighted = {name: 0.0 for name in TELEMETRY_FIELDS}
+        latest = None
+        total = 0.0
+        end = until
+
+        # Walk from the newest sample back to the first one at or before since.
+        for offset in range(1, self.count + 1):
+            index = (self._next - offset) % self.capacity
+            timestamp = self.times[index]
+            if timestamp > until:
+                continue
+
+            start = max(timestamp, since)
+            weight = end - start
+            total += weight
+            for name, values in self.values.items():
+                value = values[index]
+                weighted[name] += weight * value
+                if minimum[name] is None or value < minimum[name]:
+                    minimum[name] = value
+                if maximum[name] is None or value > maximum[name]:
+                    maximum[name] = value
+            if latest is None:
+                latest = index
+
+            end = start
+            if timestamp <= since:
+                break
+
+        if latest is None:
+            return None
+
+        return {name: (minimum[name], weighted[name] / total if total > 0 else values[latest], maximum[name])
+                for name, values in self.values.items()}
+
+
+class TelemetryHistory:
+    """
+        Keeps a TelemetryBuffer per thermostat and periodically publishes aggregates of the last
+        interval as Home Assistant sensors: min/mean/max room and floor temperature, and the time
+        weighted mean of the relay on figures. The thermostats only report relay on time as rolling
+        2, 30 and 365 day figures, which are published as such rather than as a per-interval duty cycle.
+    """
+
+    def __init__(self, mqtt_con: MqttConnector, interval: float = 900, capacity: int = 2048):
+        self.mqtt_con = mqtt_con
+        self.interval = interval
+        self.capacity = capacity
+        self.buffers: Dict[str, TelemetryBuffer] = {}
+        self.names: Dict[str, str] = {}
+
+    def record(self, thermostat: Thermostat, timestamp: float = None):
+        buffer = self.buffers.get(thermostat.SerialNumber)
+        if buffer is None:
+            buffer = TelemetryBuffer(self.capacity)
+            self.buffers[thermostat.SerialNumber] = buffer
+
+        self.names[thermostat.SerialNumber] = thermostat.GroupName
+        if not buffer.append(time.time() if timestamp is None else timestamp, thermostat):
+            logger.debug("Skipped incomplete telemetry sample for thermostat with serial number %s.", thermostat.SerialNumber)
+
+    def state(self, serialnumber: str, since: float, until: float) -> Optional[dict]:
+        aggregates = self.buffers[serialnumber].aggregate(since, until)
+        if aggregates is None:
+            return None
+
+        state = {}
+        for name, prefix in zip(TEMPERATURE_FIELDS, ("room_temperature", "floor_temperature")):
+            low, mean, high = aggregates[name]
+            state[f"{prefix}_min"] = low / 100
+            state[f"{prefix}_mean"] = round(mean / 100, 2)
+            state[f"{prefix}_max"] = high / 100
+
+        state["relay_on_2_days"] = round(aggregates["RelayOn2Days"][1], 1)
+        state["relay_on_30_days"] = round(aggregates["RelayOn30Days"][1], 1)
+        state["relay_on_365_days"] = round(aggregates["RelayOn365Days"][1], 1)
+
+        return state
+
+    def publish_configs(self, serialnumber: str, state_topic: str):
+        for key, (name, unit, device_class) in TELEMETRY_SENSORS.items():
+            config = {
+                "name": f"{self.names[serialnumber]} {name}",
+                "unique_id": f"{serialnumber}_{key}",
+                "object_id": f"micromatic_thermostat_{serialnumber}_{key}",
+                "state_topic": state_topic,
+                "value_template": f"{{{{ value_json.{key} }}}}",
+                "state_class": "measurement",
+                "availability": [
+                    {"topic": self.mqtt_con.gateway_availability_topic},
+                    {"topic": self.mqtt_con.availability_topics[serialnumber]}
+                ],
+                "availability_mode": "all",
+                "device": {"identifiers": serialnumber}
+            }
+            if unit is not None:
+                config["unit_of_measurement"] = unit
+            if device_class is not None:
+                config["device_class"] = device_class
+            self.mqtt_con.publish(f"{self.mqtt_con.config_prefix}/sensor/micromatic_thermostat_{serialnumber}_{key}/config", json.dumps(config))
+
+    async def publish(self, since: float, until: float):
+        for serialnumber in list(self.buffers):
+            # Thermostats not announced to Home Assistant yet have no device to attach the sensors to.
+            if serialnumber not in self.mqtt_con.availability_topics:
+                continue
+
+            state = self.state(serialnumber, since, until)
+            if state is None:
+                continue
+
+            state_topic = f"{self.mqtt_con.config_prefix}/sensor/micromatic_thermostat_{serialnumber}_telemetry/state"
+            self.publish_configs(serialnumber, state_topic)
+            self.mqtt_con.publish(state_topic, json.dumps(state))
+
+    async def run(self):
+        since = time.time()
+        while True:
+            await asyncio.sleep(self.interval)
+            until = time.time()
+            try:
+                await self.publish(since, until)
+            except Exception:
+                logger.exception("Failed to publish thermostat telemetry.")
+            since = until
@@ -0,0 +1,113 @@
+import gzip
+import json
+import logging
+import os
+import time
+import zlib
+from typing import Iterator, List, Tuple
+
+logger = logging.getLogger("MQTT_MicromaticGateway")
+
+# Compressed bytes decoded at a time when reading a capture. Damage loses at most the frames in one chunk.
+READ_CHUNK = 1024
+
+
+def session_path(path: str, started: float = None) -> str:
+    """
+        File for one recording session: the start time is added before the extension, so
+        capture.json.gz becomes capture.20261017T013500.json.gz. A counter is added if that file exists.
+    """
+    for extension in (".json.gz", ".gz"):
+        if path.endswith(extension):
+            root = path[:-len(extension)]
+            break
+    else:
+        root, extension = os.path.splitext(path)
+
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.localtime(started))
+    candidate = f"{root}.{stamp}{extension}"
+    counter = 1
+    while os.path.exists(candidate):
+        candidate = f"{root}.{stamp}-{counter}{extension}"
+        counter += 1
+
+    return candidate
+
+
+class FrameRecorder:
+    """
+        Writes raw websocket frames with their wall clock receive time to a gzip compressed file,
+        one JSON object per line: {"t": <unix time>, "m": <frame>}.
+        Every recording session gets its own file next to path (see session_path), so a file left
+        unterminated by a crash is never appended to. The compressor is flushed on the first frame after
+        flush_interval seconds, so a crash only loses the frames received since the last flush.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1):
+        self.path = session_path(path)
+        self.flush_interval = flush_interval
+        self.frames: int = 0
+        self._file = gzip.open(self.path, "xb")
+        self._last_flush = time.monotonic()
+
+    def record(self, frame):
+        if isinstance(frame, bytes):
+            frame = frame.decode("utf-8", errors="replace")
+
+        self._file.write(json.dumps({"t": time.time(), "m": frame}, separators=(",", ":")).encode() + b"\n")
+        self.frames += 1
+
+        now = time.monotonic()
+        if now - self._last_flush >= self.flush_interval:
+            self._file.flush(zlib.Z_SYNC_FLUSH)
+            self._last_flush = now
+
+    def close(self):
+        self._file.close()
+        logger.info("Recorded %d websocket frames to %s.", self.frames, self.path)
+
+
+def _decode_lines(path: str, lines: List[bytes]) -> Iterator[Tuple[float, str]]:
+    for line in lines:
+        try:
+            record = json.loads(line)
+            yield record["t"], record["m"]
+        except (ValueError, TypeError, KeyError):
+            logger.warning("Skipping undecodable frame in capture file %s.", path)
+
+
+def read_capture(path: str) -> Iterator[Tuple[float, str]]:
+    """
+        Yield (timestamp, frame) for every frame in a capture written by FrameRecorder.
+        The file is decompressed in small chunks, so a file cut short by a crash or damaged later on
+        still yields every frame before the damage.
+    """
+    decompressor = zlib.decompressobj(wbits=31)
+    in_member = False
+    pending = b""
+
+    with open(path, "rb") as f:
+        try:
+            while True:
+                chunk = f.read(READ_CHUNK)
+                if not chunk:
+                    break
+
+                # A file may hold several gzip members back to back.
+                while chunk:
+                    in_member = True
+                    pending += decompressor.decompress(chunk)
+                    chunk = b""
+                    if decompressor.eof:
+                        chunk = decompressor.unused_data
+                        decompressor = zlib.decompressobj(wbits=31)
+                        in_member = False
+
+                *lines, pending = pending.split(b"\n")
+                yield from _decode_lines(path, lines)
+        except zlib.error as e:
+            logger.warning("Capture file %s is damaged, stopped reading at the damage: %s", path, e)
+            return
+
+    if in_member:
+        logger.warning("Capture file %s ends with an incomplete gzip stream.", path)
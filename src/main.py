@@ -1,10 +1,17 @@
 import asyncio
 import MqttRelay
 import Microtemp
-from dacite import from_dict
+import Account
+import GatewayCache
+import Liveness
+import Metrics
+import Telemetry
 import json
+import math
+import random
 import time
-from typing import Dict
+from functools import partial
+from typing import List
 import logging
 import argparse
 
@@ -14,8 +21,28 @@ parser.add_argument("--mqtt_port", help="MQTT broker port", required=True)
 parser.add_argument("--mqtt_username", help="MQTT username", required=True)
 parser.add_argument("--mqtt_password", help="MQTT password", required=True)
 parser.add_argument("--config_prefix", help="MQTT config prefix for Home Assistant", required=True, default="homeassistant")
-parser.add_argument("--micromatic_username", help="Micromatic username", required=True)
-parser.add_argument("--micromatic_password", help="Micromatic password", required=True)
+parser.add_argument("--mqtt_client_id", help="MQTT client ID, unique per broker. Generated if not given", default=None)
+parser.add_argument("--micromatic_username", help="Micromatic username")
+parser.add_argument("--micromatic_password", help="Micromatic password")
+parser.add_argument("--micromatic_account", help="Additional Micromatic account as username:password. Can be given several times", action="append", default=[])
+parser.add_argument("--command_coalesce_window", help="Seconds to merge bursts of commands for a thermostat into one API request", type=float, default=0.5)
+parser.add_argument("--max_concurrent_commands", help="Maximum number of thermostat change requests sent to the API at the same time", type=int, default=4)
+parser.add_argument("--pending_state_timeout", help="Seconds to show a commanded state in Home Assistant before it is rolled back if the server has not confirmed it", type=float, default=10)
+parser.add_argument("--thermostat_offline_timeout", help="Seconds without websocket updates before a thermostat is marked offline", type=float, default=3600)
+parser.add_argument("--api_base_url", help="Base URL of the Micromatic cloud API", default="https://min.microtemp.no")
+parser.add_argument("--api_rate_limit", help="Maximum sustained Micromatic API requests per second, 0 to disable", type=float, default=5)
+parser.add_argument("--fallback_poll_interval", help="Seconds between REST polls of the thermostats while the websocket is down or stale, 0 to disable", type=float, default=60)
+parser.add_argument("--healthy_poll_interval", help="Seconds between REST polls of the thermostats while the websocket is healthy, 0 to disable", type=float, default=0)
+parser.add_argument("--metrics_port", help="Port serving Prometheus metrics, 0 to disable", type=int, default=0)
+parser.add_argument("--metrics_host", help="Address the metrics server listens on. Use 0.0.0.0 to expose it to the network", default="127.0.0.1")
+parser.add_argument("--metrics_profiler", help="Serve POST /profile/start and /profile/stop on the metrics port to capture a profile", action="store_true")
+parser.add_argument("--metrics_mqtt_interval", help="Seconds between publishing gateway metrics as Home Assistant sensors, 0 to disable", type=float, default=0)
+parser.add_argument("--telemetry_interval", help="Seconds between publishing temperature and relay on aggregates per thermostat as Home Assistant sensors, 0 to disable", type=float, default=0)
+parser.add_argument("--telemetry_samples", help="Telemetry samples kept per thermostat", type=int, default=2048)
+parser.add_argument("--session_file", help="File used to persist the Micromatic API session between restarts", default=None)
+parser.add_argument("--websocket_capture_file", help="Record every raw websocket frame with its receive time for offline replay. Each run writes a new gzip file named after this path and its start time", default=None)
+parser.add_argument("--cache_file", help="File used to persist the thermostat inventory and discovery configs between restarts", default=None)
+parser.add_argument("--cache_save_interval", help="Seconds between saving changes to the cache file", type=float, default=60)
 
 logging_level = "INFO"
 logger = logging.getLogger("MQTT_MicromaticGateway")
@@ -28,92 +55,254 @@ ch.setFormatter(log_format)
 logger.addHandler(ch)
 
 
-# Thermostat registery. Could probably be a part of the Thermostat dataclass...
-thermostats: Dict[str, Microtemp.Thermostat] = {}
+# Accounts served by this gateway, each with its own thermostat registry.
+accounts: List[Account.Account] = []
+liveness: Liveness.LivenessTracker = None
+telemetry: Telemetry.TelemetryHistory = None
+mqtt_connector: MqttRelay.MqttConnector = None
+background_tasks = set()
 
-async def handle_websocket_msg(message, mqtt_con: MqttRelay.MqttConnector):
-    message = json.loads(message)
-    if not message:
-        return
-    for item in message['M']:
-        if isinstance(item, str):
-            item = json.loads(item)
-            if not item['Thermostat']:
-                return
+async def handle_websocket_msg(message, mqtt_con: MqttRelay.MqttConnector, account: Account.Account, received: float = None):
+    # received is the time.perf_counter() at which the frame arrived, before it waited in the handler queue.
+    start = time.perf_counter() if received is None else received
+    Metrics.WEBSOCKET_MESSAGES.inc()
+    thermostats = account.thermostats
+
+    for data in Microtemp.parse_notification(message):
+        serialnumber = data['SerialNumber']
+        thermo = thermostats.get(serialnumber)
+        try:
+            if thermo is None:
+                thermo = Microtemp.Thermostat.from_api(data)
+            else:
+                thermo.update_from_api(data)
+        except (TypeError, ValueError) as e:
+            logger.warning("Ignoring invalid websocket message for thermostat with serial number %s: %s", serialnumber, e)
+            continue
+
+        logger.debug("Recieved incoming message on websocket for thermostat with serial number %s.", serialnumber)
 
-            thermo = from_dict(data_class=Microtemp.Thermostat, data=item['Thermostat'])
-            thermostats[item['Thermostat']['SerialNumber']] = thermo
-            logger.debug("Recieved incoming message on websocket for thermostat with serial number %s.", thermo.SerialNumber)
+        if serialnumber not in thermostats:
+            # Announce the new thermostat to Home Assistant before publishing its availability and state.
+            logger.info("Found new thermostat with serial number %s on websocket.", serialnumber)
+            thermostats[serialnumber] = thermo
+            await mqtt_con.mqtt_publish_configs(thermostats)
 
-            await mqtt_con.update_publish_state(item['Thermostat']['SerialNumber'], thermostats)
-            await mqtt_con.publish_availability("online", item['Thermostat']['SerialNumber'])
+        await liveness.seen(serialnumber)
+        mqtt_con.reconcile_pending(serialnumber, thermostats)
+        await mqtt_con.update_publish_state(serialnumber, thermostats)
+        account.schedule_timer.reschedule(serialnumber)
+        if telemetry is not None:
+            telemetry.record(thermo)
+
+    Metrics.WEBSOCKET_PIPELINE_SECONDS.observe(time.perf_counter() - start)
 
 
 async def handle_mqtt_message(client, topic, payload, qos, properties):
-    # Handle incoming MQTT messages. Change Thermostat change-flag to True.
+    # Handle incoming MQTT messages. Queue the requested changes for the command dispatcher.
 
     logger.debug("Recieved message on topic %s:\n%s", topic, payload)
 
+    if topic == mqtt_connector.status_topic:
+        if payload == b"online":
+            # Home Assistant restarted and needs discovery configs and states again.
+            task = asyncio.create_task(publish_all(mqtt_connector, force=True))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+        return
+
+    serialnumber = mqtt_connector.command_routes.get(topic)
+    account = account_for(serialnumber)
+    if account is None:
+        logger.debug("Ignoring message on unknown topic %s.", topic)
+        return
+
     modes = {
             "auto": 1,
             "heat": 3,
             "off": 5
         }
-    
-    payload = json.loads(payload)
-    serialnumber = payload['unique_id']
-    
-    thermostat = thermostats[serialnumber]
-
-    if 'target_temperature' in payload:
-        thermostat.ManuelFloorTemperature = int(payload['target_temperature'] * 100)
-        thermostat.ManuelRoomTemperature = int(payload['target_temperature'] * 100)
-        
-    thermostat.RegulationMode = modes[payload['mode']]
-    thermostat.isChanged = True
-
-    
-async def update_state_loop(api_con: Microtemp.ApiConnection):
-    # Checks if any of the thermostats has updated state. And publish new state to MQTT
 
+    changes = {}
+    try:
+        payload = json.loads(payload)
+        if 'target_temperature' in payload:
+            target = payload['target_temperature']
+            if isinstance(target, bool) or not isinstance(target, (int, float)) or not math.isfinite(target):
+                raise ValueError(f"Invalid target temperature {target!r}")
+            if not MqttRelay.MIN_TEMP <= target <= MqttRelay.MAX_TEMP:
+                raise ValueError(f"Target temperature {target} outside {MqttRelay.MIN_TEMP}-{MqttRelay.MAX_TEMP}")
+            changes['ManuelFloorTemperature'] = int(target * 100)
+            changes['ManuelRoomTemperature'] = int(target * 100)
+
+        changes['RegulationMode'] = modes[payload['mode']]
+    except (ValueError, TypeError, KeyError, OverflowError):
+        logger.warning("Ignoring malformed command on topic %s: %s", topic, payload)
+        return
+
+    account.dispatcher.submit(serialnumber, changes)
+    mqtt_connector.publish_pending(serialnumber, account.thermostats, changes)
+
+
+def account_for(serialnumber: str) -> Account.Account:
+    for account in accounts:
+        if serialnumber in account.thermostats:
+            return account
+
+    return None
+
+
+async def publish_account(mqtt_con: MqttRelay.MqttConnector, account: Account.Account):
+    await mqtt_con.mqtt_publish_configs(account.thermostats)
+    await liveness.publish_all(account.thermostats)
+    await mqtt_con.update_publish_state("all", account.thermostats)
+    account.schedule_timer.reschedule_all()
+
+
+async def publish_all(mqtt_con: MqttRelay.MqttConnector, force: bool = False):
+    if force:
+        mqtt_con.reset_publish_cache()
+
+    for account in accounts:
+        await publish_account(mqtt_con, account)
+
+
+async def refresh_from_api(account: Account.Account, mqtt_con: MqttRelay.MqttConnector):
+    await account.api_con.ensure_authenticated()
+    await account.api_con.get_all_thermostats(account.thermostats)
+    await publish_account(mqtt_con, account)
+    if telemetry is not None:
+        for thermostat in account.thermostats.values():
+            telemetry.record(thermostat)
+    GatewayCache.save_cache(account.cache_file, account.thermostats, mqtt_con.config_hashes)
+
+
+async def refresh_in_background(account: Account.Account, mqtt_con: MqttRelay.MqttConnector, min_backoff: float = 5, max_backoff: float = 300):
+    # Retries the startup refresh with jittered exponential backoff. Cached state is served in the meantime.
+    attempts = 0
     while True:
-        for key in thermostats:
-            thermostat = thermostats[key]
+        try:
+            await refresh_from_api(account, mqtt_con)
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            delay = min(max_backoff, min_backoff * 2 ** attempts)
+            delay = random.uniform(delay / 2, delay)
+            attempts += 1
+            logger.warning("Failed to fetch thermostats for account %s: %s. Retrying in %.1f seconds.", account.name, e, delay)
+            await asyncio.sleep(delay)
+
+
+def register_gauges(mqtt_con: MqttRelay.MqttConnector):
+    # Totals over all accounts.
+    def api_queue_depth():
+        depth = {}
+        for account in accounts:
+            for priority, value in account.api_con.limiter.queue_depth().items():
+                key = (("priority", str(priority)),)
+                depth[key] = depth.get(key, 0) + value
+        return depth
+
+    Metrics.registry.gauge("micromatic_websocket_connected", "Number of connected account websockets.", lambda: sum(account.websocket.connected for account in accounts))
+    Metrics.registry.gauge("micromatic_websocket_queue_depth", "Websocket frames waiting to be handled.", lambda: sum(account.websocket.queue_depth for account in accounts))
+    Metrics.registry.gauge("micromatic_command_queue_depth", "Thermostat commands waiting to be sent.", lambda: sum(account.dispatcher.depth for account in accounts))
+    Metrics.registry.gauge("micromatic_pending_states", "Commanded states waiting for confirmation.", lambda: len(mqtt_con.pending_states))
+    Metrics.registry.gauge("micromatic_api_queue_depth", "API requests waiting for the rate limiter by priority.", api_queue_depth)
+    Metrics.registry.gauge("micromatic_thermostats_online", "Thermostats currently online.", lambda: len(liveness.online))
+
+
+def account_credentials(args) -> list:
+    credentials = []
+    if args.micromatic_username or args.micromatic_password:
+        if not (args.micromatic_username and args.micromatic_password):
+            parser.error("--micromatic_username and --micromatic_password must be given together")
+        credentials.append((args.micromatic_username, args.micromatic_password))
+
+    for value in args.micromatic_account:
+        try:
+            credentials.append(Account.parse_account(value))
+        except ValueError as e:
+            parser.error(str(e))
+
+    if not credentials:
+        parser.error("At least one Micromatic account is required")
+
+    usernames = [username for username, _ in credentials]
+    if len(set(usernames)) != len(usernames):
+        parser.error("Each Micromatic account can only be given once")
+
+    return credentials
 
-            if thermostat.isChanged:
-                thermostat.isChanged = False
-                await api_con.change_state(thermostat)
-                
-        
-        await asyncio.sleep(0.4)
 
 async def main():
+    global liveness, telemetry, mqtt_connector
+
     args = parser.parse_args()
-    mqtt_client = MqttRelay.MqttConnector(args.mqtt_broker, args.mqtt_port, args.mqtt_username, args.mqtt_password, args.config_prefix)
+    credentials = account_credentials(args)
+    mqtt_client = MqttRelay.MqttConnector(args.mqtt_broker, args.mqtt_port, args.mqtt_username, args.mqtt_password, args.config_prefix,
+                                          args.pending_state_timeout, args.mqtt_client_id)
+    mqtt_connector = mqtt_client
     await mqtt_client.connect(on_message=handle_mqtt_message)
 
-    microtemp_api_con = Microtemp.ApiConnection(username=args.micromatic_username, password=args.micromatic_password)
-    microtemp_api_con.authenticate()
+    liveness = Liveness.LivenessTracker(mqtt_client, args.thermostat_offline_timeout)
+
+    # One API session, websocket and registry per account. Files get a per-account name when serving several accounts.
+    shared = len(credentials) > 1
+    for username, password in credentials:
+        microtemp_api_con = Microtemp.ApiConnection(username=username, password=password,
+                                                  session_file=Account.account_path(args.session_file, username, shared),
+                                                  rate_limit=args.api_rate_limit, base_url=args.api_base_url)
+        microtemp_api_con.load_session()
+        accounts.append(Account.Account(username, microtemp_api_con, mqtt_client, liveness, args.command_coalesce_window, args.max_concurrent_commands,
+                                        args.fallback_poll_interval, args.healthy_poll_interval,
+                                        cache_file=Account.account_path(args.cache_file, username, shared),
+                                        capture_file=Account.account_path(args.websocket_capture_file, username, shared)))
 
-    microtemp_websocket = Microtemp.Websocket(microtemp_api_con, mqtt_client)
+    if args.telemetry_interval > 0:
+        telemetry = Telemetry.TelemetryHistory(mqtt_client, args.telemetry_interval, args.telemetry_samples)
 
-    await microtemp_api_con.get_all_thermostats(thermostats)
-    await mqtt_client.mqtt_publish_configs(thermostats)
-    
-    time.sleep(2)
-    await mqtt_client.publish_availability("online", "all")
-    await mqtt_client.update_publish_state("all", thermostats)
+    register_gauges(mqtt_client)
 
+    await mqtt_client.connected.wait()
 
-    
-    mqtt_task = asyncio.create_task(update_state_loop(microtemp_api_con), name="mqtt_task")
-    websocket_task = asyncio.create_task(microtemp_websocket.connect_await_incoming(handle_websocket_msg), name="websocket_task")
+    # Serve the cached inventory right away. Configs already published by the previous run are skipped.
+    for account in accounts:
+        cache = GatewayCache.load_cache(account.cache_file)
+        GatewayCache.restore_thermostats(cache, account.thermostats)
+        mqtt_client.config_hashes.update(cache["config_hashes"])
+        if account.thermostats:
+            logger.info("Loaded %d thermostats for account %s from cache.", len(account.thermostats), account.name)
+            await publish_account(mqtt_client, account)
 
-    await asyncio.gather(mqtt_task, websocket_task)
+    tasks = [asyncio.create_task(liveness.run(), name="liveness_task")]
+    tasks += [asyncio.create_task(account.schedule_timer.run(), name=f"schedule_timer_task_{account.name}") for account in accounts]
+    if telemetry is not None:
+        tasks.append(asyncio.create_task(telemetry.run(), name="telemetry_task"))
+    if args.metrics_port:
+        tasks.append(asyncio.create_task(Metrics.serve(args.metrics_port, args.metrics_host, args.metrics_profiler), name="metrics_task"))
+    if args.metrics_mqtt_interval > 0:
+        tasks.append(asyncio.create_task(Metrics.publish_sensors(mqtt_client, args.metrics_mqtt_interval), name="metrics_sensor_task"))
 
+    try:
+        for account in accounts:
+            handler = partial(handle_websocket_msg, account=account)
+            tasks.append(asyncio.create_task(refresh_in_background(account, mqtt_client), name=f"refresh_task_{account.name}"))
+            tasks.append(asyncio.create_task(account.dispatcher.run(), name=f"dispatcher_task_{account.name}"))
+            tasks.append(asyncio.create_task(account.websocket.connect_await_incoming(handler, account.capture_file), name=f"websocket_task_{account.name}"))
+            if args.fallback_poll_interval > 0 or args.healthy_poll_interval > 0:
+                tasks.append(asyncio.create_task(account.poller.run(), name=f"poller_task_{account.name}"))
+            if account.cache_file:
+                tasks.append(asyncio.create_task(GatewayCache.save_periodically(account.cache_file, account.thermostats, mqtt_client.config_hashes,
+                                                                                args.cache_save_interval), name=f"cache_task_{account.name}"))
+
+        await asyncio.gather(*tasks)
+    finally:
+        for account in accounts:
+            GatewayCache.save_cache(account.cache_file, account.thermostats, mqtt_client.config_hashes)
+            await account.api_con.close()
 
 
 if __name__ == "__main__":
 
     asyncio.run(main(), debug=False)
-